@@ -0,0 +1,218 @@
+"""Post-training compression of trained weight dicts.
+-- int8 quantization with one scale per output channel, calibrated on sample activations
+-- low-rank factorization of conv layers into two thinner convs by truncated SVD
+-- structured pruning of the output channels of the VGG16 convs
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+# Layer whose output is the input of each conv layer of FCN16VGG
+LAYER_INPUTS = {'conv1_2': 'conv1_1', 'conv2_1': 'pool1', 'conv2_2': 'conv2_1',
+                'conv3_1': 'pool2', 'conv3_2': 'conv3_1', 'conv3_3': 'conv3_2',
+                'conv4_1': 'pool3', 'conv4_2': 'conv4_1', 'conv4_3': 'conv4_2',
+                'conv5_1': 'pool4', 'conv5_2': 'conv5_1', 'conv5_3': 'conv5_2',
+                'conv6_1': 'pool5', 'conv6_2': 'conv6_1', 'conv6_3': 'conv6_2',
+                'conv7': 'conv6_3', 'score_fr': 'conv7',
+                'score_pool4': 'pool4', 'score_pool3': 'pool3'}
+
+# Layers reading the output channels of each VGG16 conv (through pooling), the
+# input channels of their kernels are pruned together with the producing filters
+PRUNE_CONSUMERS = {'conv1_1': ['conv1_2'], 'conv1_2': ['conv2_1'],
+                   'conv2_1': ['conv2_2'], 'conv2_2': ['conv3_1'],
+                   'conv3_1': ['conv3_2'], 'conv3_2': ['conv3_3'],
+                   'conv3_3': ['conv4_1', 'score_pool3', 'score_pool3_mask'],
+                   'conv4_1': ['conv4_2'], 'conv4_2': ['conv4_3'],
+                   'conv4_3': ['conv5_1', 'score_pool4', 'score_pool4_mask'],
+                   'conv5_1': ['conv5_2'], 'conv5_2': ['conv5_3'],
+                   'conv5_3': ['conv6_1']}
+
+# Candidate clipping thresholds, as ratios of the largest absolute weight of a channel
+CLIP_RATIOS = [1.0, 0.9, 0.8, 0.7, 0.6, 0.5]
+
+
+def quantize_kernel(kernel, clip):
+    '''
+    kernel: float conv kernel [h, w, in, out]
+    clip: [out] largest representable absolute weight of every output channel
+    Return: (int8 kernel, float32 scale [out]), kernel ~= kernel_q * scale
+    '''
+    scale = (np.maximum(clip, 1e-12) / 127.0).astype(np.float32)
+    kernel_q = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+    return (kernel_q, scale)
+
+def dequantize_kernel(kernel_q, scale):
+    return kernel_q.astype(np.float32) * scale
+
+def calibrate_clip(kernel, inputs, ratios=CLIP_RATIOS):
+    '''
+    Choose the clipping threshold of every output channel that minimizes the squared
+    error of the layer output (before bias and relu) on the calibration inputs.
+    inputs: list of activations [1, H, W, in] feeding the layer
+    Return: clip [out], float32
+    '''
+    kernel = np.asarray(kernel, dtype=np.float32)
+    max_abs = np.abs(kernel).reshape(-1, kernel.shape[3]).max(axis=0)
+    candidates = [quantize_kernel(kernel, max_abs * ratio) for ratio in ratios]
+    errors = np.zeros((len(ratios), kernel.shape[3]))
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        x = tf.placeholder(tf.float32, shape=[None, None, None, kernel.shape[2]])
+        w = tf.placeholder(tf.float32, shape=kernel.shape)
+        conv = tf.nn.conv2d(x, w, strides=[1, 1, 1, 1], padding='SAME')
+        for activation in inputs:
+            reference = sess.run(conv, feed_dict={x: activation, w: kernel})
+            for (i, (kernel_q, scale)) in enumerate(candidates):
+                out = sess.run(conv, feed_dict={x: activation, w: dequantize_kernel(kernel_q, scale)})
+                errors[i] += np.square(out - reference).reshape(-1, kernel.shape[3]).sum(axis=0)
+
+    best = np.argmin(errors, axis=0)
+    print('Clip ratios chosen: %s' % str(dict(zip(ratios, np.bincount(best, minlength=len(ratios))))))
+    return (max_abs * np.asarray(ratios)[best]).astype(np.float32)
+
+def quantize_weights(data_dict, layers, calibration_inputs=None):
+    '''
+    data_dict: trained weight dict, layer -> (kernel, bias)
+    layers: conv layers to quantize, e.g ['conv6_3', 'conv7']
+    calibration_inputs: {layer: list of input activations}, see LAYER_INPUTS.
+                        Layers without calibration inputs are clipped at their largest weight.
+    Return: new weight dict where the given layers are (int8 kernel, bias, scale),
+            nn.conv_layer() builds them with an in-graph dequantization
+    '''
+    quantized = {}
+    for key in data_dict.keys():
+        quantized[key] = data_dict[key]
+    for layer in layers:
+        (kernel, bias) = data_dict[layer][:2]
+        kernel = np.asarray(kernel, dtype=np.float32)
+        if calibration_inputs is not None and layer in calibration_inputs:
+            print('Calibrating %s' % layer)
+            clip = calibrate_clip(kernel, calibration_inputs[layer])
+        else:
+            clip = np.abs(kernel).reshape(-1, kernel.shape[3]).max(axis=0)
+        (kernel_q, scale) = quantize_kernel(kernel, clip)
+        quantized[layer] = (kernel_q, np.asarray(bias, dtype=np.float32), scale)
+        error = np.abs(dequantize_kernel(kernel_q, scale) - kernel).mean()
+        print('Quantized %s: %s, mean abs weight error %.6f' % (layer, str(kernel_q.shape), error))
+    return quantized
+
+def weight_bytes(data_dict):
+    '''Total size of the arrays of a weight dict'''
+    total = 0
+    for key in data_dict.keys():
+        value = data_dict[key]
+        if not isinstance(value, (tuple, list)):
+            value = [value]
+        total += sum(np.asarray(v).nbytes for v in value)
+    return total
+
+def get_svd_rank(singular_values, rank=None, energy=None):
+    '''Given rank, or the smallest rank keeping the energy fraction of the squared singular values'''
+    if rank is not None:
+        return min(rank, len(singular_values))
+    if energy is None:
+        raise ValueError('Either rank or energy has to be given.')
+    cumulative = np.cumsum(np.square(singular_values)) / np.sum(np.square(singular_values))
+    return min(int(np.searchsorted(cumulative, energy) + 1), len(singular_values))
+
+def factorize_kernel(kernel, bias, rank=None, energy=None):
+    '''
+    Truncated SVD of a conv kernel [h, w, in, out] into a [h, w, in, rank] conv
+    followed by a [1, 1, rank, out] conv, the bias moves to the second conv.
+    Return: ((kernel_u, bias_u), (kernel_v, bias_v))
+    '''
+    kernel = np.asarray(kernel, dtype=np.float32)
+    (h, w, c_in, c_out) = kernel.shape
+    (U, S, Vt) = np.linalg.svd(kernel.reshape(h * w * c_in, c_out), full_matrices=False)
+    r = get_svd_rank(S, rank, energy)
+    root = np.sqrt(S[:r])
+    kernel_u = (U[:, :r] * root).reshape(h, w, c_in, r).astype(np.float32)
+    kernel_v = (root[:, np.newaxis] * Vt[:r]).reshape(1, 1, r, c_out).astype(np.float32)
+    bias_u = np.zeros(r, dtype=np.float32)
+    return ((kernel_u, bias_u), (kernel_v, np.asarray(bias, dtype=np.float32)))
+
+def factorize_weights(data_dict, layers, rank=None, energy=None):
+    '''
+    data_dict: trained weight dict, layer -> (kernel, bias)
+    layers: conv layers to factorize, e.g ['conv6_3', 'conv7']
+    rank: target rank of every layer, or energy: fraction of the spectrum energy to keep
+    Return: (new weight dict, {layer: rank}). A layer is replaced by layer+'_u' and layer+'_v',
+            nn.conv_layer() builds the two convs when it finds them instead of the layer
+    '''
+    factorized = {}
+    for key in data_dict.keys():
+        if key not in layers:
+            factorized[key] = data_dict[key]
+    ranks = {}
+    for layer in layers:
+        (kernel, bias) = data_dict[layer][:2]
+        (factor_u, factor_v) = factorize_kernel(kernel, bias, rank, energy)
+        factorized[layer + '_u'] = factor_u
+        factorized[layer + '_v'] = factor_v
+        ranks[layer] = factor_u[0].shape[3]
+        print('Factorized %s: %s -> %s + %s' % (layer, str(np.shape(kernel)), str(factor_u[0].shape), str(factor_v[0].shape)))
+    return (factorized, ranks)
+
+def conv_macs(data_dict, layers):
+    '''Multiply-accumulates per output pixel of the given layers, factorized ones included'''
+    total = 0
+    for layer in layers:
+        names = [layer] if layer in data_dict else [layer + '_u', layer + '_v']
+        for name in names:
+            total += int(np.prod(np.shape(data_dict[name][0])))
+    return total
+
+def l1_filter_scores(data_dict, layer):
+    '''L1 norm of every filter (output channel) of a conv layer'''
+    kernel = np.asarray(data_dict[layer][0], dtype=np.float32)
+    return np.abs(kernel).reshape(-1, kernel.shape[3]).sum(axis=0)
+
+def activation_filter_scores(activations):
+    '''Mean absolute activation of every channel, activations: list of [1, H, W, C] layer outputs'''
+    total = 0.0
+    count = 0
+    for activation in activations:
+        total = total + np.abs(activation).reshape(-1, activation.shape[3]).sum(axis=0)
+        count += int(np.prod(activation.shape[:3]))
+    return total / count
+
+def prune_layer(data_dict, layer, keep):
+    '''
+    Keep only the output channels `keep` of layer and the matching input channels of its
+    consumers (PRUNE_CONSUMERS), in place. Per output channel arrays of the entry, i.e.
+    bias and int8 scale, are sliced with the kernel. Factorized consumers are sliced at name+'_u'.
+    '''
+    entry = data_dict[layer]
+    data_dict[layer] = tuple([np.asarray(entry[0])[..., keep]] + [np.asarray(v)[keep] for v in entry[1:]])
+    for consumer in PRUNE_CONSUMERS[layer]:
+        if consumer not in data_dict:
+            consumer = consumer + '_u'
+            if consumer not in data_dict:
+                continue
+        entry = data_dict[consumer]
+        data_dict[consumer] = tuple([np.asarray(entry[0])[:, :, keep, :]] + list(entry[1:]))
+
+def prune_weights(data_dict, ratios, scores=None):
+    '''
+    data_dict: trained weight dict
+    ratios: {layer: fraction of filters to remove}, layers in PRUNE_CONSUMERS
+    scores: {layer: per filter importance}, default l1_filter_scores()
+    Return: new weight dict with the lowest scoring filters removed, nn.conv_layer()
+            takes the narrower shapes from the weights so FCN16VGG builds from it unchanged
+    '''
+    pruned = {}
+    for key in data_dict.keys():
+        pruned[key] = data_dict[key]
+    for layer in ratios.keys():
+        if scores is not None and layer in scores:
+            layer_scores = scores[layer]
+        else:
+            layer_scores = l1_filter_scores(pruned, layer)
+        num_keep = max(1, int(round(len(layer_scores) * (1.0 - ratios[layer]))))
+        keep = np.sort(np.argsort(layer_scores)[::-1][:num_keep])
+        prune_layer(pruned, layer, keep)
+        print('Pruned %s: %d -> %d filters' % (layer, len(layer_scores), num_keep))
+    return pruned
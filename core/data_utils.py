@@ -4,19 +4,380 @@ from PIL import Image
 import os
 import sys
 import random
+import json
+import shutil
+import hashlib
+import threading
 import numpy as np
 
 from dataset.VOCDataSet import VOCDataSet
 from dataset.CityDataSet import CityDataSet
 
+ARCHIVE_INDEX = 'index.json'
+
 def load_weight(path):
 
     # Initial network params
     fpath = os.path.abspath(os.path.join(path, os.curdir))
-    data_dict = np.load(fpath, encoding='latin1').item()
+    if os.path.isdir(fpath):
+        # Per-layer archive written by weight_archive_transform()
+        data_dict = WeightArchive(fpath)
+    else:
+        data_dict = np.load(fpath, encoding='latin1').item()
     print("Successfully load weight file from %s."%fpath)
     return data_dict
 
+class WeightArchive(object):
+    '''
+    Read-only dict-like view of a per-layer weight archive, a directory holding
+    one .npy file per array plus an index.json describing each layer:
+        {"conv1_1": {"type": "tuple", "files": ["conv1_1_0.npy", "conv1_1_1.npy"]},
+         "upscore8": {"type": "array", "files": ["upscore8.npy"]}}
+    Arrays are memory-mapped when a layer is looked up, so only the layers
+    that are actually used are paged in, and nothing stays resident once the
+    returned arrays are dropped.
+    File names are relative to the archive, so the delta snapshots of CheckpointWriter
+    can refer to unchanged layers in older archives, e.g "../ckpt_10000/conv1_1_0.npy".
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, ARCHIVE_INDEX), 'r') as f:
+            self.index = json.load(f)
+
+    def has_key(self, key):
+        return key in self.index
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        entry = self.index[key]
+        arrays = [np.load(os.path.join(self.path, fname), mmap_mode='r') for fname in entry['files']]
+        if entry['type'] == 'array':
+            return arrays[0]
+        return tuple(arrays)
+
+    def get(self, key, default=None):
+        if key in self.index:
+            return self[key]
+        return default
+
+def save_weight_archive(data_dict, archive_path):
+    '''
+    Write a weight dict, e.g. the result of sess.run(var_dict), into a per-layer
+    archive that can be loaded lazily by load_weight(archive_path).
+    '''
+    if not os.path.isdir(archive_path):
+        os.makedirs(archive_path)
+    index = {}
+    for key in data_dict.keys():
+        value = data_dict[key]
+        if isinstance(value, (tuple, list)):
+            entry = {'type': 'tuple', 'files': []}
+            for i in range(len(value)):
+                fname = '%s_%d.npy' % (key, i)
+                np.save(os.path.join(archive_path, fname), np.asarray(value[i]))
+                entry['files'].append(fname)
+        else:
+            fname = '%s.npy' % key
+            np.save(os.path.join(archive_path, fname), np.asarray(value))
+            entry = {'type': 'array', 'files': [fname]}
+        index[key] = entry
+    with open(os.path.join(archive_path, ARCHIVE_INDEX), 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    print("Successfully save weight archive to %s."%archive_path)
+
+def weight_archive_transform(path, archive_path):
+    '''
+    Convert an existing pickled weight dict (.npy) e.g city_fcn8s_skip_100000.npy
+    into a per-layer archive directory.
+    Usage: weight_archive_transform('../data/vgg16.npy', '../data/vgg16_archive')
+    '''
+    data_dict = load_weight(path)
+    save_weight_archive(data_dict, archive_path)
+
+class LogitCache(object):
+    '''
+    Per image cache of network scores on disk, e.g the teacher scores for distillation,
+    one .npy per image id stored as float16 unless dtype is given.
+    '''
+
+    def __init__(self, path, dtype=np.float16):
+        self.path = path
+        self.dtype = dtype
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _fname(self, img_id):
+        return os.path.join(self.path, '%s.npy' % str(img_id))
+
+    def get(self, img_id):
+        '''Return: cached scores as float32, None if img_id is not cached'''
+        fname = self._fname(img_id)
+        if not os.path.isfile(fname):
+            return None
+        return np.load(fname).astype(np.float32)
+
+    def put(self, img_id, scores):
+        np.save(self._fname(img_id), np.asarray(scores).astype(self.dtype))
+
+class FeatureCache(object):
+    '''
+    Memory-mapped store of per image network activations, e.g the frozen trunk outputs
+    pool3, pool4 and conv7 for training only the skip head (FCN16VGG.train_head).
+    One .npy per feature of shape [num_images, h, w, channels] opened with open_memmap,
+    a filled.npy flag per image and an index.json with the shapes and the dtype.
+    All images need the same size, which holds for Cityscapes (1024x2048).
+    '''
+
+    def __init__(self, path, shapes=None, num_images=None, dtype=np.float16):
+        '''
+        Open the cache at path, or create it when shapes ({name: [h, w, channels]})
+        and num_images are given and path holds no cache yet.
+        '''
+        self.path = path
+        index_path = os.path.join(path, ARCHIVE_INDEX)
+        if not os.path.isfile(index_path):
+            if shapes is None or num_images is None:
+                raise ValueError('No feature cache in %s, shapes and num_images are needed to create it.' % path)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            index = {'num_images': num_images, 'dtype': np.dtype(dtype).name,
+                     'shapes': dict((name, list(shape)) for (name, shape) in shapes.items())}
+            for (name, shape) in index['shapes'].items():
+                np.lib.format.open_memmap(os.path.join(path, '%s.npy' % name), mode='w+',
+                                          dtype=dtype, shape=tuple([num_images] + shape))
+            np.save(os.path.join(path, 'filled.npy'), np.zeros(num_images, dtype=np.bool_))
+            with open(index_path, 'w') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+        with open(index_path, 'r') as f:
+            self.index = json.load(f)
+        self.names = sorted(self.index['shapes'].keys())
+        self.features = dict((name, np.load(os.path.join(path, '%s.npy' % name), mmap_mode='r+')) for name in self.names)
+        self.filled = np.load(os.path.join(path, 'filled.npy'), mmap_mode='r+')
+
+    def shape(self, name):
+        return self.index['shapes'][name]
+
+    def has(self, img_id):
+        return bool(self.filled[img_id])
+
+    def put(self, img_id, features):
+        '''features: {name: [1, h, w, channels]} as returned by sess.run'''
+        for name in self.names:
+            self.features[name][img_id] = features[name][0]
+        self.filled[img_id] = True
+
+    def get(self, img_id):
+        '''Return: {name: [1, h, w, channels] float32}'''
+        return dict((name, self.features[name][img_id][np.newaxis].astype(np.float32)) for name in self.names)
+
+    def flush(self):
+        for name in self.names:
+            self.features[name].flush()
+        self.filled.flush()
+
+def _layer_digest(arrays):
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update((str(array.dtype) + str(array.shape)).encode('ascii'))
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+class CheckpointWriter(object):
+    '''
+    Write weight snapshots, e.g sess.run(var_dict), from a background thread as per-layer
+    archives path/<prefix>_<step> which load with load_weight(), so the training loop only
+    pays for fetching the variables and never waits for the disk.
+    A snapshot is written into a temporary directory and renamed once complete.
+    If the previous snapshot is still being written, a newer one replaces the pending one.
+    archive: False to write each snapshot as a single pickled path/<prefix>_<step>.npy instead,
+             like np.save(path, sess.run(var_dict))
+    delta: only write the layers that changed since the last snapshot, the index.json of the
+           snapshot refers to the files of unchanged layers in older snapshots
+    keep: number of most recent snapshots kept, None to keep all of them
+    keep_every: also keep the snapshots whose step is a multiple of keep_every
+    Files of removed snapshots that a kept delta snapshot still refers to stay on disk,
+    without an index.json, so the removed snapshot itself can not be loaded anymore.
+    Call close() at the end of training to write the pending snapshot.
+    An error of the writer thread is raised again by the next save() or close().
+    '''
+
+    def __init__(self, path, prefix='ckpt', archive=True, delta=False, keep=None, keep_every=None):
+        if delta and not archive:
+            raise ValueError('Delta snapshots need archive=True.')
+        self.path = path
+        self.prefix = prefix
+        self.archive = archive
+        self.delta = delta
+        self.keep = keep
+        self.keep_every = keep_every
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # (step, name, index) of the written snapshots, oldest first
+        self.snapshots = []
+        # layer -> (digest, files relative to path) of the last written snapshot
+        self.layers = {}
+        # Names of removed snapshots whose files are still used by kept ones
+        self.stale = []
+
+        self.pending = None
+        self.closed = False
+        # Exception of the last failed write, raised by the next save() or close()
+        self.error = None
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, step, weights):
+        '''Queue a snapshot, weights: dict of numpy arrays or tuples of them, returns immediately'''
+        self._raise_error()
+        with self.cond:
+            if self.pending is not None:
+                print('Checkpoint of step %d not written yet, replaced by step %d' % (self.pending[0], step))
+            self.pending = (step, weights)
+            self.cond.notify()
+
+    def close(self):
+        '''Write the pending snapshot and stop the writer thread'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        with self.cond:
+            (error, self.error) = (self.error, None)
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                (step, weights) = self.pending
+                self.pending = None
+            try:
+                self._write(step, weights)
+                self._remove_old()
+            except Exception as e:
+                print('Warning: failed to write checkpoint of step %d: %s' % (step, e))
+                with self.cond:
+                    self.error = e
+
+    def _write(self, step, weights):
+        name = '%s_%d' % (self.prefix, step)
+        if not self.archive:
+            name += '.npy'
+        tmp_path = os.path.join(self.path, name + '.tmp')
+        try:
+            if self.archive:
+                (index, layers, num_written) = self._write_archive(name, tmp_path, weights)
+            else:
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, weights)
+                (index, layers, num_written) = (None, {}, len(weights))
+            final_path = os.path.join(self.path, name)
+            if os.path.isdir(final_path):
+                shutil.rmtree(final_path)
+            elif os.path.isfile(final_path):
+                os.remove(final_path)
+            os.rename(tmp_path, final_path)
+        except (IOError, OSError):
+            # Nothing may refer to a partially written snapshot
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            elif os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Later deltas only refer to files of committed snapshots
+        self.layers = layers
+        self.snapshots.append((step, name, index))
+        print('Checkpoint saved: %s (%d of %d layers written)' % (final_path, num_written, len(weights)))
+
+    def _write_archive(self, name, tmp_path, weights):
+        '''Return: (index, layer -> (digest, files relative to path), number of layers written)'''
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        index = {}
+        layers = {}
+        num_written = 0
+        for key in weights.keys():
+            value = weights[key]
+            if isinstance(value, (tuple, list)):
+                (entry_type, arrays) = ('tuple', [np.asarray(v) for v in value])
+                fnames = ['%s_%d.npy' % (key, i) for i in range(len(arrays))]
+            else:
+                (entry_type, arrays) = ('array', [np.asarray(value)])
+                fnames = ['%s.npy' % key]
+            digest = _layer_digest(arrays) if self.delta else None
+            if digest is not None and key in self.layers and self.layers[key][0] == digest:
+                files = self.layers[key][1]
+                index[key] = {'type': entry_type, 'files': [os.path.join(os.pardir, f) for f in files]}
+            else:
+                for (fname, array) in zip(fnames, arrays):
+                    np.save(os.path.join(tmp_path, fname), array)
+                files = [os.path.join(name, fname) for fname in fnames]
+                index[key] = {'type': entry_type, 'files': fnames}
+                num_written += 1
+            layers[key] = (digest, files)
+        with open(os.path.join(tmp_path, ARCHIVE_INDEX), 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        return (index, layers, num_written)
+
+    def _remove_old(self):
+        if self.keep is None:
+            return
+        num_snapshots = len(self.snapshots)
+        kept = []
+        removed = []
+        for (i, snapshot) in enumerate(self.snapshots):
+            if i >= num_snapshots - self.keep or (self.keep_every is not None and snapshot[0] % self.keep_every == 0):
+                kept.append(snapshot)
+            else:
+                removed.append(snapshot)
+        used = set()
+        for (step, name, index) in kept:
+            if index is None:
+                continue
+            for entry in index.values():
+                used.update(os.path.normpath(os.path.join(name, f)) for f in entry['files'])
+
+        stale = []
+        for (step, name, index) in removed:
+            if index is None:
+                os.remove(os.path.join(self.path, name))
+                print('Checkpoint removed: %s' % os.path.join(self.path, name))
+        for name in [snapshot[1] for snapshot in removed if snapshot[2] is not None] + self.stale:
+            snapshot_path = os.path.join(self.path, name)
+            if os.path.isfile(os.path.join(snapshot_path, ARCHIVE_INDEX)):
+                os.remove(os.path.join(snapshot_path, ARCHIVE_INDEX))
+                print('Checkpoint removed: %s' % snapshot_path)
+            for fname in os.listdir(snapshot_path):
+                if os.path.join(name, fname) not in used:
+                    os.remove(os.path.join(snapshot_path, fname))
+            if os.listdir(snapshot_path):
+                stale.append(name)
+            else:
+                os.rmdir(snapshot_path)
+        self.snapshots = kept
+        self.stale = stale
+
 def vgg16_weight_transform(vgg16_path, vgg16_new_path):
     '''
     This function is used to transform the format for original vgg16.npy 
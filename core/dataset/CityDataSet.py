@@ -12,6 +12,7 @@ from collections import namedtuple
 from scipy.misc import imsave
 from scipy.misc import imread
 from scipy.misc import toimage
+from dataset.batching import group_by_size, stack_batch
 # define a data structure
 Label_City = namedtuple( 'Label' , ['name', 'labelId', 'trainId', 'color',] )
 
@@ -29,6 +30,13 @@ class CityDataSet():
 
         # Load dataset indices
         (self.img_indices, self.lbl_indices) = self.load_indicies()
+        # Keep only every num_shards-th image from shard on, e.g one shard per training tower
+        num_shards = params.get('num_shards', 1)
+        if num_shards > 1:
+            shard = params.get('shard', 0)
+            self.img_indices = self.img_indices[shard::num_shards]
+            self.lbl_indices = self.lbl_indices[shard::num_shards]
+            print('Shard %d of %d: %d images' % (shard, num_shards, len(self.img_indices)))
 
         # Create mapping of (lable_name, id, color)
         self.labels = [
@@ -135,6 +143,31 @@ class CityDataSet():
             return (image,label)
 
 
+    def batch_generator(self, batch_size, img_ids=None):
+        """
+        - Iterate over the dataset in batches of same-size images, self.idx is not used
+        - img_ids: positions in self.img_indices to load, default is the whole dataset in order
+        - Return: generator of (ids, images, labels)
+          ids: img_indices positions of the batch, pass them to save_trainID_img()
+          images: [batch, H, W, 3], labels: [batch, 1, H, W] or masks [batch, H, W, 2], None for test
+        """
+        if img_ids is None:
+            img_ids = range(len(self.img_indices))
+        for group in group_by_size(self.load_samples(img_ids), batch_size):
+            yield stack_batch(group)
+
+    def load_samples(self, img_ids):
+        for img_id in img_ids:
+            image = self.load_image(self.img_indices[img_id])
+            label = None
+            if self.dataset_type != 'test':
+                label = self.load_label(self.lbl_indices[img_id])
+                if self.use_gt_mask:
+                    label = label[:,:,:,range(2)]
+                else:
+                    label = label.reshape(1, *label.shape)
+            yield (img_id, image, label)
+
     def load_image(self, fname):
         """
         Load input image and preprocess for using pretrained weight from Caffee:
@@ -213,13 +246,16 @@ class CityDataSet():
             vector[-iaxis_pad_width[1]:] = values
         return vector
 
-    def save_trainID_img(self, fname_prefix, pred_in):
+    def save_trainID_img(self, fname_prefix, pred_in, img_idx=None):
         '''
         This method is meant to save original prediction into .png
-        pred_in shape: [1, H, W] -> need to reshape to [H, W] to save .png
+        pred_in shape: [1, H, W] or [H, W] -> need to reshape to [H, W] to save .png
+        img_idx: position of the image in self.img_indices, e.g an id from batch_generator().
+                 Default is the image last returned by next_batch()
         '''
-        # Since self.idx is already increased by 1, need to decrease 1.
-        img_idx = self.idx - 1
+        if img_idx is None:
+            # Since self.idx is already increased by 1, need to decrease 1.
+            img_idx = self.idx - 1
         img_inx = self.img_indices[img_idx].split('/')
         fname = img_inx[6]
         fname = fname.split('_')
@@ -227,7 +263,7 @@ class CityDataSet():
         save_path = os.path.join(self.pred_save_path,fname)
 
         # Reshape to [H,W]
-        pred_in = np.reshape(pred_in, (pred_in.shape[1], pred_in.shape[2]))
+        pred_in = np.reshape(pred_in, pred_in.shape[-2:])
         # Save .png, don't rescale
         toimage(pred_in, high=19, low=0, cmin=0, cmax=19).save(save_path)
         #print("TrainIDs prediction saved to %s "%save_path)
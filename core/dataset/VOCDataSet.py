@@ -7,6 +7,7 @@ import os
 import sys
 import random
 import numpy as np
+from dataset.batching import group_by_size, stack_batch
 
 class VOCDataSet():
 
@@ -64,6 +65,26 @@ class VOCDataSet():
 
         return (image,label)
 
+    def batch_generator(self, batch_size, indices=None):
+        """
+        - Iterate over the dataset in batches of same-size images, self.idx is not used
+        - indices: index strings to load, default is self.indices in order
+        - Return: generator of (ids, images, labels), ids are the index strings of the batch,
+          labels is None if any image of the batch has no ground truth
+        """
+        if indices is None:
+            indices = self.indices
+        for group in group_by_size(self.load_samples(indices), batch_size):
+            yield stack_batch(group)
+
+    def load_samples(self, indices):
+        for idx_str in indices:
+            image = self.load_image(idx_str)
+            label = self.load_label(idx_str)
+            if label is not None:
+                label = label.reshape(1, *label.shape)
+            yield (idx_str, image, label)
+
     def load_indices(self, fold_type='train', classes_dict=None, filter_no_label=False):
         """
         Load indices of images and labels as list
@@ -0,0 +1,51 @@
+"""Grouping of samples into batches of same-size images"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+def group_by_size(samples, batch_size, max_pending=None):
+    '''
+    samples: iterable of (id, image, label), image of shape [H, W, 3]
+    batch_size: maximum number of samples per batch
+    max_pending: maximum number of samples held back while waiting for same-size images,
+                 the largest group is yielded early when it is reached. Default 4*batch_size
+    Yield: lists of (id, image, label) whose images all have the same shape,
+           smaller groups are yielded at the end
+    '''
+    if max_pending is None:
+        max_pending = 4 * batch_size
+    pending = {}
+    num_pending = 0
+    for sample in samples:
+        shape = sample[1].shape
+        group = pending.setdefault(shape, [])
+        group.append(sample)
+        num_pending += 1
+        if len(group) == batch_size:
+            del pending[shape]
+            num_pending -= len(group)
+            yield group
+        elif num_pending >= max_pending:
+            largest = max(pending.keys(), key=lambda s: len(pending[s]))
+            group = pending.pop(largest)
+            num_pending -= len(group)
+            yield group
+    for group in pending.values():
+        yield group
+
+def stack_batch(group):
+    '''
+    Return: (ids, images, labels) of a group from group_by_size(),
+            images stacked to [batch, H, W, 3], labels concatenated along the
+            batch axis or None if any label is missing
+    '''
+    ids = [sample[0] for sample in group]
+    images = np.stack([sample[1] for sample in group])
+    labels = [sample[2] for sample in group]
+    if any(label is None for label in labels):
+        labels = None
+    else:
+        labels = np.concatenate(labels)
+    return (ids, images, labels)
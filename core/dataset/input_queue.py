@@ -0,0 +1,52 @@
+"""In-graph input pipeline for training: file names are queued, read and decoded by
+queue runner threads inside the session, so loading the next images overlaps the
+training step instead of going through feed_dict.
+Start the threads with tf.train.start_queue_runners() after variable initialization.
+"""
+
+from __future__ import print_function
+
+import tensorflow as tf
+
+def decode_image(fname):
+    '''Return: float32 BGR image [h, w, 3] as CityDataSet.load_image()'''
+    image = tf.image.decode_png(tf.read_file(fname), channels=3)
+    image = tf.cast(image, tf.float32)
+    return tf.reverse(image, [False, False, True])     # RGB -> BGR
+
+def decode_label(fname, use_gt_mask=False):
+    '''Return: int32 trainID label [h, w, 1], or the first two channels [h, w, 2] of a gt mask image'''
+    if use_gt_mask:
+        label = tf.image.decode_png(tf.read_file(fname), channels=0)
+        label = tf.slice(label, [0, 0, 0], [-1, -1, 2])
+    else:
+        label = tf.image.decode_png(tf.read_file(fname), channels=1)
+    return tf.cast(label, tf.int32)
+
+def input_queue(dataset, image_size=(1024, 2048), batch_size=1, shuffle=True, num_threads=4, capacity=8,
+                min_after_dequeue=2, num_epochs=None):
+    '''
+    dataset: CityDataSet providing the file lists img_indices and lbl_indices (e.g a shard)
+    image_size: (height, width) of every image, batches need a static shape
+    shuffle: shuffle the file order every epoch and the decoded images in a buffer of
+             min_after_dequeue ... capacity images (24MB each at full resolution),
+             otherwise files are read in order
+    num_threads: number of threads reading and decoding images in parallel
+    num_epochs: stop after this many passes (tf.errors.OutOfRangeError), None to loop forever.
+                Its counter is a local variable, run tf.initialize_local_variables() too.
+    Return: (images [batch, h, w, 3] tf.float32, labels [batch, h, w, 1 or 2] tf.int32),
+            e.g FCN16VGG.train(params, images, tf.reshape(labels, [-1]), ...) or
+            InstanceFCN8s.train(params, images, labels, ...) with use_gt_mask
+    '''
+    (height, width) = image_size
+    (img_fname, lbl_fname) = tf.train.slice_input_producer([dataset.img_indices, dataset.lbl_indices],
+                                                           num_epochs=num_epochs, shuffle=shuffle)
+    image = decode_image(img_fname)
+    label = decode_label(lbl_fname, dataset.use_gt_mask)
+    image.set_shape([height, width, 3])
+    label.set_shape([height, width, 2 if dataset.use_gt_mask else 1])
+
+    if shuffle:
+        return tf.train.shuffle_batch([image, label], batch_size, capacity=capacity,
+                                      min_after_dequeue=min_after_dequeue, num_threads=num_threads)
+    return tf.train.batch([image, label], batch_size, capacity=capacity, num_threads=num_threads)
@@ -81,6 +81,8 @@ args.colorized          = hasattr(sys.stderr, "isatty") and sys.stderr.isatty()
 args.bold               = colors.BOLD if args.colorized else ""
 args.nocol              = colors.ENDC if args.colorized else ""
 args.JSONOutput         = True
+args.perImageNPZOutput  = True
+args.exportPerImageFile = os.path.join( args.cityscapesPath , "evaluationResults" , "perImageStats.npz" )
 args.quiet              = False
 args.debug				= False
 
@@ -295,6 +297,50 @@ def writeJSONFile(wholeData, args):
 	'''
 	pass
 
+# Per-image confusion matrix, same layout as the global one:
+# rows are ground truth ids, columns are predicted ids.
+def getImageConfusionMatrix(predictionNp, groundTruthNp, args):
+	nbIds = max(args.evalLabels) + 1
+	flatIds = groundTruthNp.astype(np.int64).ravel() * nbIds + predictionNp.astype(np.int64).ravel()
+	return np.bincount(flatIds, minlength=nbIds*nbIds).reshape(nbIds, nbIds)
+
+# Per-class TP/FP/FN of a single image, computed the same way as getIouScoreForLabel.
+# Only labels that are not ignored in evaluation are reported.
+def getImageClassCounts(imageConfMatrix, args):
+	notIgnored = [l for l in args.evalLabels if not id2label[l].ignoreInEval]
+	tp = imageConfMatrix[notIgnored, notIgnored]
+	fn = imageConfMatrix[notIgnored, :].sum(axis=1) - tp
+	fp = imageConfMatrix[notIgnored, :][:, notIgnored].sum(axis=0) - tp
+	return tp.astype(np.uint32), fp.astype(np.uint32), fn.astype(np.uint32)
+
+# Write per-image statistics as aligned columns into an uncompressed .npz file.
+# Row i of every per-image array belongs to imageIds[i], column j of tp/fp/fn/iou to labelIds[j].
+# Load with: stats = np.load(fileName); stats['iou'][stats['imageIds'] == 'frankfurt_000000_000294']
+def writePerImageNPZFile(perImageStats, args):
+	fileNames = sorted(perImageStats.keys())
+	if not fileNames:
+		print('No per image statistics to write.')
+		return
+	labelIds = [l for l in args.evalLabels if not id2label[l].ignoreInEval]
+	columns = {}
+	for key in ["nbPixels", "nbNotIgnoredPixels", "nbTruePositivePixels", "tp", "fp", "fn"]:
+		columns[key] = np.array([perImageStats[f]["columns"][key] for f in fileNames])
+
+	denom = (columns["tp"] + columns["fp"] + columns["fn"]).astype(np.float64)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		iou = np.where(denom > 0, columns["tp"] / denom, np.nan).astype(np.float32)
+
+	ensurePath(os.path.dirname(args.exportPerImageFile))
+	np.savez(args.exportPerImageFile,
+		imageIds        = np.array([perImageStats[f]["columns"]["imageId"] for f in fileNames]),
+		predictionFiles = np.array(fileNames),
+		labelIds        = np.array(labelIds, dtype=np.uint8),
+		labelNames      = np.array([id2label[l].name for l in labelIds]),
+		iou             = iou,
+		**columns)
+	if not args.quiet:
+		print('Per image statistics of {} images saved to {}'.format(len(fileNames), args.exportPerImageFile))
+
 # Evaluate image lists pairwise.
 def evaluateImgLists(predictionImgList, groundTruthImgList, args):
 	'''
@@ -399,6 +445,9 @@ def evaluateImgLists(predictionImgList, groundTruthImgList, args):
 	    print("")
 	'''
 
+	if args.evalPixelAccuracy and args.perImageNPZOutput:
+		writePerImageNPZFile(perImageStats, args)
+
     # write result file
 	'''
 	allResultsDict = createResultDict( confMatrix, classScoreList, classInstScoreList, categoryScoreList, categoryInstScoreList, perImageStats, args )
@@ -509,12 +558,31 @@ def evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, inst
 		perImageStats[predictionImgFileName]["nbNotIgnoredPixels"] = np.count_nonzero(notIgnoredPixels)
 		perImageStats[predictionImgFileName]["nbCorrectPixels"]    = np.count_nonzero(erroneousPixels)
 
+		if args.perImageNPZOutput:
+			# Fixed-size numeric record, stacked into columns by writePerImageNPZFile
+			imageConfMatrix = getImageConfusionMatrix(predictionNp, groundTruthNp, args)
+			(tp, fp, fn) = getImageClassCounts(imageConfMatrix, args)
+			notIgnored = [l for l in args.evalLabels if not id2label[l].ignoreInEval]
+			perImageStats[predictionImgFileName]["columns"] = {
+				"imageId"            : getCoreImageFileName(groundTruthImgFileName),
+				"nbPixels"           : nbPixels,
+				"nbNotIgnoredPixels" : imageConfMatrix[notIgnored, :].sum(),
+				"nbTruePositivePixels" : tp.sum(),
+				"tp"                 : tp,
+				"fp"                 : fp,
+				"fn"                 : fn,
+			}
+
 	return nbPixels
 
-def run_eval(resultPath):
+def run_eval(resultPath, perImagePath=None):
 	global args
 	
 	args.predictionPath = resultPath
+	# Walk the new result path, run_eval may be called for several ones
+	args.predictionWalk = None
+	if perImagePath is not None:
+		args.exportPerImageFile = perImagePath
 	predictionImgList = []
 	groundTruthImgList = []
 	avgScore = 0.0
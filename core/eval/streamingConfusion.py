@@ -0,0 +1,65 @@
+'''
+Streaming confusion matrix on trainIds, used to evaluate predictions directly
+in memory without writing labelIDs .png files for evalPixelSemantic.py.
+
+USAGE:
+  conf = StreamingConfusionMatrix(num_classes=20, ignore_labels=[19])
+  for each image: conf.add(prediction, truth)
+  conf.mean_iou()
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class StreamingConfusionMatrix(object):
+
+    def __init__(self, num_classes, ignore_labels=[19], class_names=None):
+        '''
+        num_classes: number of trainIds predicted by the network
+        ignore_labels: trainIds that are ignored in evaluation, e.g. void(19).
+                       Ground truth pixels with these labels (or >= num_classes, e.g. 255) are skipped.
+        '''
+        self.num_classes = num_classes
+        self.ignore_labels = list(ignore_labels)
+        self.eval_labels = [l for l in range(num_classes) if l not in self.ignore_labels]
+        self.class_names = class_names
+        # rows are ground truth, columns are prediction
+        self.matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+
+    def add(self, prediction, truth):
+        prediction = np.asarray(prediction, dtype=np.int64).ravel()
+        truth = np.asarray(truth, dtype=np.int64).ravel()
+        if prediction.size != truth.size:
+            raise ValueError('Prediction has %d pixels but ground truth has %d.' % (prediction.size, truth.size))
+        valid = truth < self.num_classes
+        for label in self.ignore_labels:
+            valid &= truth != label
+        flat_ids = truth[valid] * self.num_classes + prediction[valid]
+        self.matrix += np.bincount(flat_ids, minlength=self.num_classes**2).reshape(self.num_classes, self.num_classes)
+
+    def class_iou(self):
+        '''Return {trainId: IoU}, nan for classes that never occur'''
+        ious = {}
+        for label in self.eval_labels:
+            tp = self.matrix[label, label]
+            fn = self.matrix[label, :].sum() - tp
+            fp = self.matrix[self.eval_labels, label].sum() - tp
+            denom = tp + fp + fn
+            ious[label] = float(tp) / denom if denom > 0 else float('nan')
+        return ious
+
+    def mean_iou(self):
+        scores = [s for s in self.class_iou().values() if not np.isnan(s)]
+        if not scores:
+            return float('nan')
+        return float(np.mean(scores))
+
+    def summary(self, title=''):
+        lines = ['%s mean IoU: %.4f' % (title, self.mean_iou())]
+        for (label, score) in sorted(self.class_iou().items()):
+            name = self.class_names[label] if self.class_names is not None else str(label)
+            lines.append('    %-15s %.4f' % (name, score))
+        return '\n'.join(lines)
@@ -14,12 +14,72 @@ import tensorflow as tf
 import numpy as np
 import nn
 import data_utils as dt
+from network.fcn_vgg16 import build_vgg16_trunk
 
 DATA_DIR = 'data'
 
+# Layers of the instance head, the rest of the weights belongs to build_vgg16_trunk()
+INSTANCE_HEAD_LAYERS = ['score_fr_mask', 'upscore_fr_2s_mask', 'score_pool4_mask',
+                        'upscore_pool4_2s_mask', 'score_pool3_mask', 'upmask']
+
+def instance_head_variables():
+    '''Return: trainable variables of the INSTANCE_HEAD_LAYERS built so far, i.e. without the trunk'''
+    return [var for var in tf.trainable_variables()
+            if len(var.op.name.split('/')) > 1 and var.op.name.split('/')[-2] in INSTANCE_HEAD_LAYERS]
+
+def build_instance_head(model, image_shape, feed_dict, num_masks, var_dict=None, defer_init=False, separable_upscore=False,
+                        upsample=True):
+    '''
+    Build the instance mask head on top of build_vgg16_trunk().
+    image_shape: tensor [batch, height, width, channels] the masks are upsampled to
+    num_masks: num_pred_class * max_instance
+    separable_upscore: run fixed bilinear upscore layers as separable upsampling, see nn.upscore_layer()
+    upsample: if False, stop at the stride 8 scores, the 'upmask' upscore (ksize 16, stride 8) is not built
+    Adds 'score_fr_mask', 'score_out_mask' and 'upmask' to model.
+    '''
+    # Skip feature fusion
+    model['score_fr_mask'] = nn.conv_layer(model['conv7'], feed_dict, "score_fr_mask",
+                                           shape=[1, 1, 4096, num_masks], relu=False,
+                                           dropout=False, var_dict=var_dict, defer_init=defer_init)
+
+    # Upsample: score_fr*2
+    upscore_fr_2s = nn.upscore_layer(model['score_fr_mask'], feed_dict, "upscore_fr_2s_mask",
+                                   tf.shape(model['pool4']), num_masks,
+                                   ksize=4, stride=2, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+    # Fuse upscore_fr_2s + score_pool4
+    in_features = model['pool4'].get_shape()[3].value
+    score_pool4 = nn.conv_layer(model['pool4'], feed_dict, "score_pool4_mask",
+                                shape=[1, 1, in_features, num_masks],
+                                relu=False, dropout=False, var_dict=var_dict, defer_init=defer_init)
+
+    fuse_pool4 = tf.add(upscore_fr_2s, score_pool4)
+
+
+    # Upsample fuse_pool4*2
+    upscore_pool4_2s = nn.upscore_layer(fuse_pool4, feed_dict, "upscore_pool4_2s_mask",
+                                        tf.shape(model['pool3']), num_masks,
+                                        ksize=4, stride=2, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+
+    # Fuse  upscore_pool4_2s + score_pool3
+    in_features = model['pool3'].get_shape()[3].value
+    score_pool3 = nn.conv_layer(model['pool3'], feed_dict, "score_pool3_mask",
+                                shape=[1, 1, in_features, num_masks],
+                                relu=False, dropout=False, var_dict=var_dict, defer_init=defer_init)
+
+    model['score_out_mask'] = tf.add(upscore_pool4_2s, score_pool3)
+    if not upsample:
+        return model
+       
+    # Upsample to original size *8 # Or we have to do it by class
+    model['upmask'] = nn.upscore_layer(model['score_out_mask'], feed_dict,
+                              "upmask", image_shape, num_masks,
+                              ksize=16, stride=8, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+
+    return model
+
 class InstanceFCN8s:
 
-    def __init__(self, data_path=None, pred_class={11:'person', 13:'car'}, gt_class={11:'person', 13:'car'}):
+    def __init__(self, data_path=None, pred_class={11:'person', 13:'car'}, gt_class={11:'person', 13:'car'}, defer_init=False):
         # Define classes to be segmented to instance level e.g {11:'person', 13:'car'}
         self.gt_class = gt_class
         self.pred_class = pred_class
@@ -31,15 +91,51 @@ class InstanceFCN8s:
         data_dict = dt.load_weight(data_path)
         self.data_dict = data_dict
 
+        # If set, variables are only shaped by the weights at graph construction
+        # and init_weights() has to be called after initialize_all_variables()
+        self.defer_init = defer_init
+
         # used to save trained weights
         self.var_dict = {}
 
+        # Variables created from weight dicts by _build_model, see load_weights()
+        self.pretrained_weights = []
 
-    def _build_model(self, image, max_instance, direct_slice, is_train=False, save_var=False, val_dict=None):
+    def init_weights(self, session):
+        '''
+        Assign the pretrained weights to the variables through placeholders.
+        Needed after variable initialization when the model was created with defer_init=True.
+        '''
+        self.load_weights(session, self.data_dict)
 
-        model = {}
+    def load_weights(self, session, weights):
+        '''
+        Reassign the variables of the already built model from a weight dict or from the
+        path of a weight file/archive, e.g. to switch between city_fcn8s_skip_*.npy snapshots
+        in a running session without rebuilding the graph.
+        Layers missing in the given weights keep their current value.
+        '''
+        if isinstance(weights, str):
+            weights = dt.load_weight(weights)
+        nn.assign_weights(session, weights, self.pretrained_weights)
+
+    def release_weights(self):
+        '''
+        Drop the reference to the pretrained weights once the variables are initialized,
+        so that the loaded dict (or the pages of a memory-mapped weight archive) can be freed.
+        The model can not be built again afterwards unless val_dict is given.
+        '''
+        self.data_dict = None
+
+
+    def _build_model(self, image, max_instance, direct_slice, is_train=False, save_var=False, val_dict=None, separable_upscore=False,
+                     upsample=True):
+
+        num_weights = len(tf.get_collection(nn.PRETRAINED_WEIGHTS))
         if val_dict is None:
             # Not during validation, use pretrained weight
+            if self.data_dict is None:
+                raise ValueError('Pretrained weights have been released, pass val_dict to build the model.')
             feed_dict = self.data_dict
         else:
             # Duing validation, use the currently trained weight
@@ -54,97 +150,60 @@ class InstanceFCN8s:
 
 
         # Step1: build fcn8s and score_out which has shape[H, W, Classes]
-        model['conv1_1'] = nn.conv_layer(image, feed_dict, "conv1_1", var_dict=var_dict)
-        model['conv1_2'] = nn.conv_layer(model['conv1_1'], feed_dict, "conv1_2", var_dict=var_dict)
-        model['pool1'] = nn.max_pool_layer(model['conv1_2'], "pool1")
-
-        model['conv2_1'] = nn.conv_layer(model['pool1'], feed_dict, "conv2_1", var_dict=var_dict)
-        model['conv2_2'] = nn.conv_layer(model['conv2_1'], feed_dict, "conv2_2", var_dict=var_dict)
-        model['pool2'] = nn.max_pool_layer(model['conv2_2'], "pool2")
-
-        model['conv3_1'] = nn.conv_layer(model['pool2'], feed_dict, "conv3_1", var_dict=var_dict)
-        model['conv3_2'] = nn.conv_layer(model['conv3_1'], feed_dict, "conv3_2", var_dict=var_dict)
-        model['conv3_3'] = nn.conv_layer(model['conv3_2'], feed_dict, "conv3_3", var_dict=var_dict)
-        model['pool3'] = nn.max_pool_layer(model['conv3_3'], "pool3")
-
-        model['conv4_1'] = nn.conv_layer(model['pool3'], feed_dict, "conv4_1", var_dict=var_dict)
-        model['conv4_2'] = nn.conv_layer(model['conv4_1'], feed_dict, "conv4_2", var_dict=var_dict)
-        model['conv4_3'] = nn.conv_layer(model['conv4_2'], feed_dict, "conv4_3", var_dict=var_dict)
-        model['pool4'] = nn.max_pool_layer(model['conv4_3'], "pool4")
-
-
-        model['conv5_1'] = nn.conv_layer(model['pool4'], feed_dict, "conv5_1", var_dict=var_dict)
-        model['conv5_2'] = nn.conv_layer(model['conv5_1'], feed_dict, "conv5_2", var_dict=var_dict)
-        model['conv5_3'] = nn.conv_layer(model['conv5_2'], feed_dict, "conv5_3", var_dict=var_dict)
-        model['pool5'] = nn.max_pool_layer(model['conv5_3'], "pool5")
-
-        model['conv6_1'] = nn.conv_layer(model['pool5'], feed_dict, "conv6_1",
-                                         shape=[3, 3, 512, 512], dropout=is_train,
-                                         keep_prob=0.5, var_dict=var_dict)
-
-        model['conv6_2'] = nn.conv_layer(model['conv6_1'], feed_dict, "conv6_2",
-                                         shape=[3, 3, 512, 512], dropout=is_train,
-                                         keep_prob=0.5, var_dict=var_dict)
-
-        model['conv6_3'] = nn.conv_layer(model['conv6_2'], feed_dict, "conv6_3",
-                                         shape=[3, 3, 512, 4096], dropout=is_train,
-                                         keep_prob=0.5, var_dict=var_dict)
-
-        model['conv7'] = nn.conv_layer(model['conv6_3'], feed_dict, "conv7",
-                                       shape=[1, 1, 4096, 4096], dropout=is_train,
-                                       keep_prob=0.5, var_dict=var_dict)
-
-        # Skip feature fusion
-        model['score_fr'] = nn.conv_layer(model['conv7'], feed_dict, "score_fr_mask",
-                                          shape=[1, 1, 4096, self.num_pred_class * max_instance], relu=False,
-                                          dropout=False, var_dict=var_dict)
-
-        # Upsample: score_fr*2
-        upscore_fr_2s = nn.upscore_layer(model['score_fr'], feed_dict, "upscore_fr_2s_mask",
-                                       tf.shape(model['pool4']), self.num_pred_class * max_instance,
-                                       ksize=4, stride=2, var_dict=var_dict)
-        # Fuse upscore_fr_2s + score_pool4
-        in_features = model['pool4'].get_shape()[3].value
-        score_pool4 = nn.conv_layer(model['pool4'], feed_dict, "score_pool4_mask",
-                                    shape=[1, 1, in_features, self.num_pred_class * max_instance],
-                                    relu=False, dropout=False, var_dict=var_dict)
-
-        fuse_pool4 = tf.add(upscore_fr_2s, score_pool4)
-
-
-        # Upsample fuse_pool4*2
-        upscore_pool4_2s = nn.upscore_layer(fuse_pool4, feed_dict, "upscore_pool4_2s_mask",
-                                            tf.shape(model['pool3']), self.num_pred_class * max_instance,
-                                            ksize=4, stride=2, var_dict=var_dict)
-
-        # Fuse  upscore_pool4_2s + score_pool3
-        in_features = model['pool3'].get_shape()[3].value
-        score_pool3 = nn.conv_layer(model['pool3'], self.data_dict, "score_pool3_mask",
-                                    shape=[1, 1, in_features, self.num_pred_class * max_instance],
-                                    relu=False, dropout=False, var_dict=var_dict)
-
-        score_out = tf.add(upscore_pool4_2s, score_pool3)
-
-    
-       
-        # Upsample to original size *8 # Or we have to do it by class
-        model['upmask'] = nn.upscore_layer(score_out, feed_dict,
-                                  "upmask", tf.shape(image), self.num_pred_class * max_instance,
-                                  ksize=16, stride=8, var_dict=var_dict)
+        model = build_vgg16_trunk(image, feed_dict, is_train=is_train, var_dict=var_dict, defer_init=self.defer_init)
+        model = build_instance_head(model, tf.shape(image), feed_dict, self.num_pred_class * max_instance,
+                                    var_dict=var_dict, defer_init=self.defer_init, separable_upscore=separable_upscore,
+                                    upsample=upsample)
 
+        self.pretrained_weights += tf.get_collection(nn.PRETRAINED_WEIGHTS)[num_weights:]
         print('InstanceFCN8s model is builded successfully!')
         print('Model: %s' % str(model.keys()))
         return model
 
-    def train(self, params, image, gt_masks, direct_slice=True, save_var=True):
+    def train(self, params, image, gt_masks, direct_slice=True, save_var=True, lowres_loss=False, label_downsample='nearest',
+              fg_loss=False, fg_dilation=16, bg_rate=0.05, accum_steps=1, head_only=False):
         '''
         Input
         image: reshaped image value, shape=[1, Height, Width, 3], tf.float32
         gt_masks: stacked instance_masks, shape=[1, h, w, num_gt_class], tf.int32
+        Both can be placeholders or the tensors of dataset.input_queue.input_queue()
+        lowres_loss: compute the loss on the stride 8 'score_out_mask' scores against downsampled
+                     instance masks, the 'upmask' upscore is not built (and not saved, i.e. bilinear)
+        label_downsample: 'nearest' or 'majority' over instance ids, see nn.downsample_labels()
+        fg_loss: evaluate the loss only on the instance pixels dilated by fg_dilation pixels
+                 (at the resolution of the loss) and a random fraction bg_rate of the background,
+                 the scores are gathered before the softmax
+        accum_steps: if > 1, average the gradients of accum_steps micro-batches before every update,
+                     the returned train_step is then a nn.GradientAccumulator, see FCN16VGG.train()
+        head_only: only train INSTANCE_HEAD_LAYERS, the trunk keeps the weights of data_path.
+                   Required for instance weights used with JointFCN8s, which runs the head on the
+                   trunk of the semantic weights.
+        '''
+        optimizer = tf.train.AdamOptimizer(params['rate'])
+        (grads_and_vars, loss) = self.gradients(params, image, gt_masks, optimizer, direct_slice=direct_slice,
+                                                save_var=save_var, lowres_loss=lowres_loss,
+                                                label_downsample=label_downsample, fg_loss=fg_loss,
+                                                fg_dilation=fg_dilation, bg_rate=bg_rate, head_only=head_only)
+        if accum_steps > 1:
+            train_step = nn.GradientAccumulator(optimizer, grads_and_vars, accum_steps)
+        else:
+            train_step = optimizer.apply_gradients(grads_and_vars)
+        
+        return train_step, loss
+
+    def gradients(self, params, image, gt_masks, optimizer, direct_slice=True, save_var=True, lowres_loss=False,
+                  label_downsample='nearest', fg_loss=False, fg_dilation=16, bg_rate=0.05, head_only=False):
+        '''
+        Build the model and loss as train() does, without the update.
+        Return: (grads_and_vars, loss), e.g for averaging the gradients of several towers in network.multi_tower
         '''
         # Build model
-        model = self._build_model(image, params['max_instance'], direct_slice=direct_slice, is_train=True, save_var=save_var)
-        pred_masks = model['upmask']
+        model = self._build_model(image, params['max_instance'], direct_slice=direct_slice, is_train=True, save_var=save_var,
+                                  upsample=not lowres_loss)
+        if lowres_loss:
+            pred_masks = model['score_out_mask']
+        else:
+            pred_masks = model['upmask']
         # Split stack by semantic class
         pred_mask_list = tf.split(3, self.num_pred_class, pred_masks)
         gt_mask_list = tf.split(3, self.num_gt_class, gt_masks)
@@ -153,30 +212,59 @@ class InstanceFCN8s:
         pred = pred_mask_list[0]
         gt = gt_mask_list[1]
 
-        shape = tf.shape(gt)
-        gt = tf.reshape(gt, [shape[0], shape[1], shape[2]])
-        
-        # Loss: softmax + cross entropy        
-        loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=gt, logits=pred))
-        train_step = tf.train.AdamOptimizer(params['rate']).minimize(loss)
+        if lowres_loss:
+            gt = nn.downsample_labels(gt, 8, tf.shape(pred)[1:3], params['max_instance'], method=label_downsample)
+        else:
+            shape = tf.shape(gt)
+            gt = tf.reshape(gt, [shape[0], shape[1], shape[2]])
         
-        return train_step, loss
+        if fg_loss:
+            # Only keep foreground and sampled background pixels
+            indices = nn.loss_pixel_indices(gt, dilation=fg_dilation, bg_rate=bg_rate)
+            pred = tf.gather(tf.reshape(pred, [-1, params['max_instance']]), indices)
+            gt = tf.gather(tf.reshape(gt, [-1]), indices)
+            num_pixels = tf.maximum(tf.cast(tf.size(indices), tf.float32), 1.0)
+            loss = tf.reduce_sum(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=gt, logits=pred)) / num_pixels
+        else:
+            # Loss: softmax + cross entropy        
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=gt, logits=pred))
+        var_list = instance_head_variables() if head_only else None
+        return optimizer.compute_gradients(loss, var_list=var_list), loss
 
-    def inference(self, params, image, direct_slice=True):
+    def inference(self, params, image, direct_slice=True, separable_upscore=False):
         """
         Input: image
-        Return: a stack of masks, shape = [h, w, num_classes],
-                each slice represent instance masks belonging to a class
+        Return: list of instance masks, one per class in pred_class, shape = [batch, h, w],
                 value of each pixel is between [0,max_instance)
         """
         # Build model
-        model = self._build_model(image, params['max_instance'], direct_slice=direct_slice, is_train=False)
+        model = self._build_model(image, params['max_instance'], direct_slice=direct_slice, is_train=False,
+                                  separable_upscore=separable_upscore)
         pred_masks = model['upmask']
 
         # Split stack by semantic class
         pred_mask_list = tf.split(3, self.num_pred_class, pred_masks)
         instance_masks = []
         for i in range(self.num_pred_class):
-            pred = tf.argmax(pred_mask_list[i], dimension=3)
-            instance_masks.append(tf.squeeze(pred))
+            instance_masks.append(tf.argmax(pred_mask_list[i], dimension=3))
         return instance_masks
+
+    def inference_scores(self, params, image, direct_slice=True, separable_upscore=False):
+        """
+        Return: full resolution instance scores before the argmax ('upmask'),
+                shape [batch, h, w, num_pred_class * max_instance], max_instance channels per class in pred_class
+        """
+        model = self._build_model(image, params['max_instance'], direct_slice=direct_slice, is_train=False,
+                                  separable_upscore=separable_upscore)
+        return model['upmask']
+
+    def inference_lowres(self, params, image, direct_slice=True):
+        """
+        Build the model without the final full resolution upsampling ('upmask').
+        Return: list of low resolution instance scores, one per class in pred_class,
+                each with shape [batch, h, w, max_instance].
+                Decode them with nn.upsample_argmax(scores[0], height, width, ksize=16, stride=8).
+        """
+        model = self._build_model(image, params['max_instance'], direct_slice=direct_slice, is_train=False,
+                                  upsample=False)
+        return tf.split(3, self.num_pred_class, model['score_out_mask'])
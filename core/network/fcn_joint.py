@@ -0,0 +1,156 @@
+"""Joint semantic and instance segmentation network.
+The VGG16 trunk is computed once and feeds both the fcn8s semantic head
+(score_fr ... upscore8) and the instance mask head (*_mask ... upmask),
+so one sess.run produces both outputs with a single copy of the trunk weights.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import tensorflow as tf
+import numpy as np
+import nn
+import data_utils as dt
+from network.fcn_vgg16 import build_vgg16_trunk, build_fcn_head
+from network.fcn_instance import build_instance_head, INSTANCE_HEAD_LAYERS
+
+def check_shared_trunk(data_dict, instance_dict):
+    '''
+    Raise ValueError if a layer outside INSTANCE_HEAD_LAYERS has different weights in the two dicts,
+    i.e. the instance head was trained on another trunk than the one it would run on.
+    '''
+    shared = [key for key in instance_dict.keys() if key not in INSTANCE_HEAD_LAYERS and data_dict.has_key(key)]
+    if not shared:
+        print('Warning: instance weights have no trunk layers, can not check that they match the trunk')
+    for key in shared:
+        (value, instance_value) = (data_dict[key], instance_dict[key])
+        if not isinstance(value, (tuple, list)):
+            (value, instance_value) = ([value], [instance_value])
+        if len(value) != len(instance_value) or \
+           not all(np.array_equal(a, b) for (a, b) in zip(value, instance_value)):
+            raise ValueError('Layer %s of the instance weights differs from the trunk, train the instance '
+                             'head with InstanceFCN8s.train(head_only=True) on the same weights.' % key)
+
+class JointFCN8s:
+
+    def __init__(self, data_path=None, instance_data_path=None, pred_class={11:'person', 13:'car'}, defer_init=False):
+        '''
+        data_path: weights of the trunk and the semantic head, e.g city_fcn8s_skip_100000.npy
+        instance_data_path: weights of the instance head, e.g city_instance_50000.npy.
+                            Only INSTANCE_HEAD_LAYERS are taken from it, so the head has to be
+                            trained on the trunk of data_path (InstanceFCN8s.train(head_only=True)).
+                            A ValueError is raised if its trunk layers differ from data_path.
+                            If None, the instance head is also loaded from data_path.
+        '''
+        self.pred_class = pred_class
+        self.num_pred_class = len(pred_class)
+
+        # Load pretrained weight
+        data_dict = dt.load_weight(data_path)
+        if instance_data_path is not None:
+            instance_dict = dt.load_weight(instance_data_path)
+            check_shared_trunk(data_dict, instance_dict)
+            merged_dict = {}
+            for key in data_dict.keys():
+                merged_dict[key] = data_dict[key]
+            for key in INSTANCE_HEAD_LAYERS:
+                if instance_dict.has_key(key):
+                    merged_dict[key] = instance_dict[key]
+            data_dict = merged_dict
+        self.data_dict = data_dict
+
+        # If set, variables are only shaped by the weights at graph construction
+        # and init_weights() has to be called after initialize_all_variables()
+        self.defer_init = defer_init
+
+        # Variables created from weight dicts by _build_model, see load_weights()
+        self.pretrained_weights = []
+
+    def init_weights(self, session):
+        '''
+        Assign the pretrained weights to the variables through placeholders.
+        Needed after variable initialization when the model was created with defer_init=True.
+        '''
+        self.load_weights(session, self.data_dict)
+
+    def load_weights(self, session, weights):
+        '''
+        Reassign the variables of the already built model from a weight dict or from the
+        path of a weight file/archive. Layers missing in the given weights keep their current value.
+        '''
+        if isinstance(weights, str):
+            weights = dt.load_weight(weights)
+        nn.assign_weights(session, weights, self.pretrained_weights)
+
+    def release_weights(self):
+        '''
+        Drop the reference to the pretrained weights once the variables are initialized.
+        '''
+        self.data_dict = None
+
+    def _build_model(self, image, num_classes, max_instance, separable_upscore=False, instance_upsample=True):
+        if self.data_dict is None:
+            raise ValueError('Pretrained weights have been released, the model can not be built again.')
+        feed_dict = self.data_dict
+        num_weights = len(tf.get_collection(nn.PRETRAINED_WEIGHTS))
+
+        model = build_vgg16_trunk(image, feed_dict, is_train=False, defer_init=self.defer_init)
+        model = build_fcn_head(model, tf.shape(image), feed_dict, num_classes, scale_min='fcn8s',
+                               outputs=['fcn8s'], defer_init=self.defer_init, separable_upscore=separable_upscore)
+        model = build_instance_head(model, tf.shape(image), feed_dict, self.num_pred_class * max_instance,
+                                    defer_init=self.defer_init, separable_upscore=separable_upscore,
+                                    upsample=instance_upsample)
+
+        self.pretrained_weights += tf.get_collection(nn.PRETRAINED_WEIGHTS)[num_weights:]
+        print('JointFCN8s model is builded successfully!')
+        print('Model: %s' % str(model.keys()))
+        return model
+
+    def inference(self, params, image, separable_upscore=False):
+        """
+        Input: image, params with 'num_classes' and 'max_instance'
+        Return: (semantic, instance_masks)
+                semantic: fcn8s trainID prediction, shape = [batch, h, w]
+                instance_masks: list of instance masks, one per class in pred_class, shape = [batch, h, w],
+                                value of each pixel is between [0,max_instance)
+        """
+        model = self._build_model(image, params['num_classes'], params['max_instance'], separable_upscore=separable_upscore)
+        semantic = tf.argmax(model['fcn8s'], dimension=3)
+
+        pred_mask_list = tf.split(3, self.num_pred_class, model['upmask'])
+        instance_masks = []
+        for i in range(self.num_pred_class):
+            pred = tf.argmax(pred_mask_list[i], dimension=3)
+            instance_masks.append(pred)
+        return semantic, instance_masks
+
+    def inference_roi(self, params, image, separable_upscore=False):
+        """
+        Same as inference() but the instance head stops at its stride 8 scores ('score_out_mask'),
+        the instance masks are decoded only around the objects of the semantic prediction:
+            mask = nn.roi_upsample_argmax(scores[0], semantic[0] == trainId, 16, 8,
+                                          kernel=upmask_kernel, channels=channels[k])
+        with trainId the k-th key of pred_class.
+        Return: (semantic, scores, upmask_kernel, channels)
+                semantic: fcn8s trainID prediction, shape = [batch, h, w]
+                scores: low resolution instance scores of all classes,
+                        shape [batch, h/8, w/8, num_pred_class * max_instance]
+                upmask_kernel: the trained 'upmask' kernel as numpy array, so the crops are decoded
+                               exactly as inference() does, or None if it is still bilinear
+                channels: one slice of the score channels per class in pred_class
+        """
+        model = self._build_model(image, params['num_classes'], params['max_instance'], separable_upscore=separable_upscore,
+                                  instance_upsample=False)
+        semantic = tf.argmax(model['fcn8s'], dimension=3)
+
+        num_masks = self.num_pred_class * params['max_instance']
+        upmask_kernel = None
+        if not nn.is_fixed_bilinear(self.data_dict, 'upmask', [16, 16, num_masks, num_masks]):
+            print('upmask is not bilinear, the ROI decode uses the trained kernel')
+            upmask_kernel = np.array(self.data_dict['upmask'], dtype=np.float32)
+        channels = [slice(k * params['max_instance'], (k + 1) * params['max_instance'])
+                    for k in range(self.num_pred_class)]
+        return semantic, model['score_out_mask'], upmask_kernel, channels
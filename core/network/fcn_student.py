@@ -0,0 +1,127 @@
+"""Narrow FCN8s student trained by distillation from a FCN16VGG teacher.
+The trunk has five blocks of conv layers with configurable widths followed by
+conv6 / conv7, and uses the same skip head as FCN16VGG (build_fcn_head), so its
+stride 8 scores 'fuse_pool3' line up with the teacher's low resolution scores.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import tensorflow as tf
+import numpy as np
+import nn
+import data_utils as dt
+from network.fcn_vgg16 import build_fcn_head, LOWRES_SCORES
+
+# Widths of the five conv blocks and of conv6 / conv7, roughly 1/16 of the VGG16 trunk MACs
+STUDENT_WIDTHS = [16, 32, 64, 128, 128, 512]
+
+def build_student_trunk(image, feed_dict, widths=STUDENT_WIDTHS, convs_per_block=2, var_dict=None, defer_init=False):
+    '''
+    conv1_1 ... conv5_x with pooling after every block, then conv6 (3x3) and conv7 (1x1) at widths[5].
+    Layers missing in feed_dict are initialized with He normal weights.
+    Return: dict of layer outputs with 'pool3', 'pool4' and 'conv7' for build_fcn_head()
+    '''
+    model = {}
+    x = image
+    in_features = image.get_shape()[3].value
+    for block in range(5):
+        for i in range(convs_per_block):
+            name = 'conv%d_%d' % (block + 1, i + 1)
+            shape = [3, 3, in_features, widths[block]]
+            x = nn.conv_layer(x, feed_dict, name, shape=shape, var_dict=var_dict, defer_init=defer_init,
+                              stddev=(2.0 / (9 * in_features))**0.5)
+            model[name] = x
+            in_features = widths[block]
+        name = 'pool%d' % (block + 1)
+        x = nn.max_pool_layer(x, name)
+        model[name] = x
+
+    model['conv6'] = nn.conv_layer(x, feed_dict, 'conv6', shape=[3, 3, in_features, widths[5]],
+                                   var_dict=var_dict, defer_init=defer_init, stddev=(2.0 / (9 * in_features))**0.5)
+    model['conv7'] = nn.conv_layer(model['conv6'], feed_dict, 'conv7', shape=[1, 1, widths[5], widths[5]],
+                                   var_dict=var_dict, defer_init=defer_init, stddev=(2.0 / widths[5])**0.5)
+    return model
+
+class StudentFCN8s:
+
+    def __init__(self, data_path=None, widths=STUDENT_WIDTHS, defer_init=False):
+        '''
+        data_path: weights of a previously trained student, None to train from scratch
+        widths: see build_student_trunk(), must match the weights when data_path is given
+        '''
+        self.data_dict = dt.load_weight(data_path) if data_path is not None else {}
+        self.widths = widths
+        self.defer_init = defer_init
+
+        # used to save trained weights
+        self.var_dict = {}
+
+        # Variables created from weight dicts by _build_model, see init_weights()
+        self.pretrained_weights = []
+
+    def init_weights(self, session):
+        '''
+        Assign the loaded weights to the variables through placeholders.
+        Needed after variable initialization when the model was created with defer_init=True.
+        '''
+        nn.assign_weights(session, self.data_dict, self.pretrained_weights)
+
+    def release_weights(self):
+        self.data_dict = None
+
+    def _build_model(self, image, num_classes, save_var=False, outputs=None, lowres_outputs=()):
+        if self.data_dict is None:
+            raise ValueError('Weights have been released, the model can not be built again.')
+        feed_dict = self.data_dict
+        var_dict = self.var_dict if save_var else None
+        num_weights = len(tf.get_collection(nn.PRETRAINED_WEIGHTS))
+
+        model = build_student_trunk(image, feed_dict, widths=self.widths, var_dict=var_dict, defer_init=self.defer_init)
+        model = build_fcn_head(model, tf.shape(image), feed_dict, num_classes, scale_min='fcn8s',
+                               outputs=outputs, var_dict=var_dict, defer_init=self.defer_init,
+                               lowres_outputs=lowres_outputs)
+
+        self.pretrained_weights += tf.get_collection(nn.PRETRAINED_WEIGHTS)[num_weights:]
+        print('Student model with widths %s is builded successfully!' % str(self.widths))
+        return model
+
+    def inference(self, image, num_classes):
+        '''Return: fcn8s trainID prediction, shape = [batch, h, w]'''
+        model = self._build_model(image, num_classes, outputs=['fcn8s'])
+        return tf.argmax(model['fcn8s'], dimension=3)
+
+    def train_distill(self, params, image, truth, teacher_scores, temperature=2.0, alpha=0.5, save_var=True):
+        '''
+        image: [1, Height, Width, 3], tf.float32
+        truth: reshaped image label, shape=[Height*Width], tf.int32
+        teacher_scores: teacher low resolution fcn8s scores, e.g FCN16VGG.inference_lowres(image, num_classes),
+                        shape [1, Height/8, Width/8, num_classes]
+        Loss: alpha * T^2 * KL(teacher || student) at temperature T
+              + (1 - alpha) * cross entropy against labels downsampled to stride 8,
+              both on the stride 8 scores, the final upscore is not built.
+        Build the student in its own variable scope when the teacher is in the same graph.
+        '''
+        num_classes = params['num_classes']
+        (score_name, ksize, stride) = LOWRES_SCORES['fcn8s']
+        model = self._build_model(image, num_classes, save_var=save_var, outputs=[], lowres_outputs=['fcn8s'])
+        scores = tf.reshape(model[score_name], [-1, num_classes])
+        teacher = tf.reshape(teacher_scores, [-1, num_classes])
+
+        teacher_prob = tf.nn.softmax(teacher / temperature)
+        kl = tf.reduce_sum(teacher_prob * (tf.log(teacher_prob + 1e-8) - tf.nn.log_softmax(scores / temperature)), 1)
+        distill_loss = tf.reduce_mean(kl) * temperature**2
+
+        img_shape = tf.shape(image)
+        labels = tf.reshape(truth, tf.pack([img_shape[0], img_shape[1], img_shape[2], 1]))
+        labels = nn.downsample_labels(labels, stride, tf.shape(model[score_name])[1:3], num_classes)
+        ce_loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(scores, tf.reshape(labels, [-1])))
+
+        loss = alpha * distill_loss + (1 - alpha) * ce_loss
+        # Only the student is trained, even if the teacher is built in the same graph
+        student_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=tf.get_variable_scope().name)
+        train_step = tf.train.AdamOptimizer(params['rate']).minimize(loss, var_list=student_vars)
+        return train_step, loss
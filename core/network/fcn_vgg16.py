@@ -17,21 +17,206 @@ import data_utils as dt
 
 DATA_DIR = 'data'
 
+# Conv layers of the five VGG16 blocks, each block ends with max pooling 'pool1' ... 'pool5'
+VGG16_BLOCKS = [['conv1_1', 'conv1_2'],
+                ['conv2_1', 'conv2_2'],
+                ['conv3_1', 'conv3_2', 'conv3_3'],
+                ['conv4_1', 'conv4_2', 'conv4_3'],
+                ['conv5_1', 'conv5_2', 'conv5_3']]
+
+def build_vgg16_block(x, feed_dict, block, model=None, var_dict=None, defer_init=False):
+    '''
+    Build VGG16 block number block (1 ... 5) on x, the layer outputs are added to model if given.
+    Return: output of the block pooling
+    '''
+    for name in VGG16_BLOCKS[block-1]:
+        x = nn.conv_layer(x, feed_dict, name, var_dict=var_dict, defer_init=defer_init)
+        if model is not None:
+            model[name] = x
+    x = nn.max_pool_layer(x, 'pool%d' % block)
+    if model is not None:
+        model['pool%d' % block] = x
+    return x
+
+def _block_rebuilder(scope, feed_dict, block, defer_init):
+    '''Return: function building block again on its input with the variables of scope, for recomputation'''
+    def rebuild(x):
+        with tf.variable_scope(scope, reuse=True):
+            return build_vgg16_block(x, feed_dict, block, defer_init=defer_init)
+    return rebuild
+
+def build_vgg16_trunk(image, feed_dict, is_train=False, var_dict=None, defer_init=False, checkpoint_blocks=()):
+    '''
+    Build the VGG16 backbone with the convolutionalized fc layers (conv1_1 ... conv7),
+    shared by FCN16VGG, InstanceFCN8s and JointFCN8s.
+    checkpoint_blocks: VGG16 blocks (1 ... 5) whose activations are recomputed in the backward pass
+                       instead of kept, see nn.checkpointed_gradients(). Their input and output are
+                       wrapped in stop_gradient and model['checkpoints'] lists the segments.
+    Return: dict of layer outputs
+    '''
+    model = {}
+    checkpoints = []
+    scope = tf.get_variable_scope()
+    x = image
+    for block in range(1, 6):
+        if block in checkpoint_blocks:
+            x_in = tf.stop_gradient(x)
+            y = tf.stop_gradient(build_vgg16_block(x_in, feed_dict, block, model, var_dict=var_dict, defer_init=defer_init))
+            checkpoints.append((x, x_in, y, _block_rebuilder(scope, feed_dict, block, defer_init)))
+            model['pool%d' % block] = y
+            x = y
+        else:
+            x = build_vgg16_block(x, feed_dict, block, model, var_dict=var_dict, defer_init=defer_init)
+    if checkpoints:
+        model['checkpoints'] = checkpoints
+
+    model['conv6_1'] = nn.conv_layer(model['pool5'], feed_dict, "conv6_1", 
+                                     shape=[3, 3, 512, 512], dropout=is_train, 
+                                     keep_prob=0.5, var_dict=var_dict, defer_init=defer_init)
+
+    model['conv6_2'] = nn.conv_layer(model['conv6_1'], feed_dict, "conv6_2", 
+                                     shape=[3, 3, 512, 512], dropout=is_train, 
+                                     keep_prob=0.5, var_dict=var_dict, defer_init=defer_init)
+
+    model['conv6_3'] = nn.conv_layer(model['conv6_2'], feed_dict, "conv6_3", 
+                                     shape=[3, 3, 512, 4096], dropout=is_train, 
+                                     keep_prob=0.5, var_dict=var_dict, defer_init=defer_init)
+
+    model['conv7'] = nn.conv_layer(model['conv6_3'], feed_dict, "conv7", 
+                                   shape=[1, 1, 4096, 4096], dropout=is_train, 
+                                   keep_prob=0.5, var_dict=var_dict, defer_init=defer_init)
+
+    return model
+
+# Output scales of the semantic head, from coarse to fine
+SCALES = ['fcn32s', 'fcn16s', 'fcn8s']
+
+# Low resolution scores of each scale and the (ksize, stride) of the upscore layer applied to them
+LOWRES_SCORES = {'fcn32s': ('score_fr', 64, 32),
+                 'fcn16s': ('fuse_pool4', 32, 16),
+                 'fcn8s': ('fuse_pool3', 16, 8)}
+
+def build_fcn_head(model, image_shape, feed_dict, num_classes, scale_min='fcn16s', outputs=None, var_dict=None, defer_init=False,
+                   separable_upscore=False, lowres_outputs=()):
+    '''
+    Build the semantic scoring head with skip connections on top of build_vgg16_trunk(),
+    or of any trunk providing 'pool3', 'pool4' and 'conv7' (see network.fcn_student).
+    image_shape: tensor [batch, height, width, channels] the scores are upsampled to
+    outputs: scales in SCALES that are upsampled to full resolution.
+             Default is every scale up to scale_min, i.e. fcn32s, fcn16s, ... scale_min.
+             Skip fusions are built only as deep as the finest requested output,
+             and full resolution upsampling only for the requested ones.
+    separable_upscore: run fixed bilinear upscore layers as separable upsampling, see nn.upscore_layer()
+    lowres_outputs: scales whose low resolution scores (LOWRES_SCORES) are needed without upsampling
+    Adds 'score_fr', 'fuse_pool4', 'fuse_pool3' (when needed) and the requested outputs to model.
+    '''
+    if outputs is None:
+        outputs = SCALES[:SCALES.index(scale_min)+1]
+    scores_needed = list(outputs) + list(lowres_outputs)
+
+    in_features = model['conv7'].get_shape()[3].value
+    model['score_fr'] = nn.conv_layer(model['conv7'], feed_dict, "score_fr", 
+                                      shape=[1, 1, in_features, num_classes], relu=False, 
+                                      dropout=False, var_dict=var_dict, defer_init=defer_init)
+
+    if 'fcn32s' in outputs:
+        model['fcn32s'] = nn.upscore_layer(model['score_fr'], feed_dict, "upscore_fr_32s", 
+                                           image_shape, num_classes,ksize=64, 
+                                           stride=32, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+
+    # fuse_pool4 is calculated also for fcn8s, because fcn8s is built on top of it
+    if 'fcn16s' in scores_needed or 'fcn8s' in scores_needed:
+        upscore_fr_2s = nn.upscore_layer(model['score_fr'], feed_dict, "upscore_fr_2s",
+                                         tf.shape(model['pool4']), num_classes,
+                                         ksize=4, stride=2, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+ 
+        # Fuse fc8 *2, pool4
+        in_features = model['pool4'].get_shape()[3].value
+        score_pool4 = nn.conv_layer(model['pool4'], feed_dict, "score_pool4", 
+                                    shape=[1, 1, in_features, num_classes], 
+                                    relu=False, dropout=False, var_dict=var_dict, defer_init=defer_init)
+        
+        model['fuse_pool4'] = tf.add(upscore_fr_2s, score_pool4)
+
+    if 'fcn16s' in outputs:
+        # Upsample fusion *16
+        model['fcn16s'] = nn.upscore_layer(model['fuse_pool4'], feed_dict, "upscore_pool4_16s",
+                                           image_shape, num_classes,
+                                           ksize=32, stride=16, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+        
+    if 'fcn8s' in scores_needed:
+        # Upsample fc8 *4
+        upscore_pool4_2s = nn.upscore_layer(model['fuse_pool4'], feed_dict, "upscore_pool4_2s",
+                                            tf.shape(model['pool3']), num_classes,
+                                            ksize=4, stride=2, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+
+        # Fuse fc8 *4, pool4 *2, pool3            
+        in_features = model['pool3'].get_shape()[3].value
+        score_pool3 = nn.conv_layer(model['pool3'], feed_dict, "score_pool3", 
+                                    shape=[1, 1, in_features, num_classes], 
+                                    relu=False, dropout=False, var_dict=var_dict, defer_init=defer_init)
+
+        model['fuse_pool3'] = tf.add(score_pool3, upscore_pool4_2s)
+
+    if 'fcn8s' in outputs:
+        # Upsample fusion *8
+        model['fcn8s'] = nn.upscore_layer(model['fuse_pool3'], feed_dict, "upscore8",
+                                          image_shape, num_classes,
+                                          ksize=16, stride=8, var_dict=var_dict, defer_init=defer_init, separable=separable_upscore)
+
+    return model
+
 class FCN16VGG:
 
-    def __init__(self, data_path=None):
+    def __init__(self, data_path=None, defer_init=False):
         # Load pretrained weight
         data_dict = dt.load_weight(data_path)
         self.data_dict = data_dict
 
+        # If set, variables are only shaped by the weights at graph construction
+        # and init_weights() has to be called after initialize_all_variables()
+        self.defer_init = defer_init
+
         # used to save trained weights
         self.var_dict = {}
 
-    def _build_model(self, image, num_classes, is_train=False, scale_min='fcn16s', save_var=False, val_dict=None):
+        # Variables created from weight dicts by _build_model, see load_weights()
+        self.pretrained_weights = []
+
+    def init_weights(self, session):
+        '''
+        Assign the pretrained weights to the variables through placeholders.
+        Needed after variable initialization when the model was created with defer_init=True.
+        '''
+        self.load_weights(session, self.data_dict)
+
+    def load_weights(self, session, weights):
+        '''
+        Reassign the variables of the already built model from a weight dict or from the
+        path of a weight file/archive, e.g. to switch between city_fcn8s_skip_*.npy snapshots
+        in a running session without rebuilding the graph.
+        Layers missing in the given weights keep their current value.
+        '''
+        if isinstance(weights, str):
+            weights = dt.load_weight(weights)
+        nn.assign_weights(session, weights, self.pretrained_weights)
+
+    def release_weights(self):
+        '''
+        Drop the reference to the pretrained weights once the variables are initialized,
+        so that the loaded dict (or the pages of a memory-mapped weight archive) can be freed.
+        The model can not be built again afterwards unless val_dict is given.
+        '''
+        self.data_dict = None
+
+    def _build_model(self, image, num_classes, is_train=False, scale_min='fcn16s', save_var=False, val_dict=None, outputs=None,
+                     separable_upscore=False, lowres_outputs=(), features=None, image_shape=None, checkpoint_blocks=()):
         
-        model = {}
+        num_weights = len(tf.get_collection(nn.PRETRAINED_WEIGHTS))
         if val_dict is None:
             # Not during validation, use pretrained weight
+            if self.data_dict is None:
+                raise ValueError('Pretrained weights have been released, pass val_dict to build the model.')
             feed_dict = self.data_dict
         else:
             # Duing validation, use the currently trained weight
@@ -44,102 +229,33 @@ class FCN16VGG:
             # During inference or validation, no need to save weights
             var_dict = None
 
-        model['conv1_1'] = nn.conv_layer(image, feed_dict, "conv1_1", var_dict=var_dict)
-        model['conv1_2'] = nn.conv_layer(model['conv1_1'], feed_dict, "conv1_2", var_dict=var_dict)
-        model['pool1'] = nn.max_pool_layer(model['conv1_2'], "pool1")
-
-        model['conv2_1'] = nn.conv_layer(model['pool1'], feed_dict, "conv2_1", var_dict=var_dict)
-        model['conv2_2'] = nn.conv_layer(model['conv2_1'], feed_dict, "conv2_2", var_dict=var_dict)
-        model['pool2'] = nn.max_pool_layer(model['conv2_2'], "pool2")
-
-        model['conv3_1'] = nn.conv_layer(model['pool2'], feed_dict, "conv3_1", var_dict=var_dict)
-        model['conv3_2'] = nn.conv_layer(model['conv3_1'], feed_dict, "conv3_2", var_dict=var_dict)
-        model['conv3_3'] = nn.conv_layer(model['conv3_2'], feed_dict, "conv3_3", var_dict=var_dict)
-        model['pool3'] = nn.max_pool_layer(model['conv3_3'], "pool3")
-
-        model['conv4_1'] = nn.conv_layer(model['pool3'], feed_dict, "conv4_1", var_dict=var_dict)
-        model['conv4_2'] = nn.conv_layer(model['conv4_1'], feed_dict, "conv4_2", var_dict=var_dict)
-        model['conv4_3'] = nn.conv_layer(model['conv4_2'], feed_dict, "conv4_3", var_dict=var_dict)
-        model['pool4'] = nn.max_pool_layer(model['conv4_3'], "pool4")
-
-
-        model['conv5_1'] = nn.conv_layer(model['pool4'], feed_dict, "conv5_1", var_dict=var_dict)
-        model['conv5_2'] = nn.conv_layer(model['conv5_1'], feed_dict, "conv5_2", var_dict=var_dict)
-        model['conv5_3'] = nn.conv_layer(model['conv5_2'], feed_dict, "conv5_3", var_dict=var_dict)
-        model['pool5'] = nn.max_pool_layer(model['conv5_3'], "pool5")
-
-        model['conv6_1'] = nn.conv_layer(model['pool5'], feed_dict, "conv6_1", 
-                                         shape=[3, 3, 512, 512], dropout=is_train, 
-                                         keep_prob=0.5, var_dict=var_dict)
-
-        model['conv6_2'] = nn.conv_layer(model['conv6_1'], feed_dict, "conv6_2", 
-                                         shape=[3, 3, 512, 512], dropout=is_train, 
-                                         keep_prob=0.5, var_dict=var_dict)
-
-        model['conv6_3'] = nn.conv_layer(model['conv6_2'], feed_dict, "conv6_3", 
-                                         shape=[3, 3, 512, 4096], dropout=is_train, 
-                                         keep_prob=0.5, var_dict=var_dict)
-
-        model['conv7'] = nn.conv_layer(model['conv6_3'], feed_dict, "conv7", 
-                                       shape=[1, 1, 4096, 4096], dropout=is_train, 
-                                       keep_prob=0.5, var_dict=var_dict)
-
-        model['score_fr'] = nn.conv_layer(model['conv7'], feed_dict, "score_fr", 
-                                          shape=[1, 1, 4096, num_classes], relu=False, 
-                                          dropout=False, var_dict=var_dict)
-
-        # fcn32s is always calculated for now
-        model['fcn32s'] = nn.upscore_layer(model['score_fr'], feed_dict, "upscore_fr_32s", 
-                                           tf.shape(image), num_classes,ksize=64, 
-                                           stride=32, var_dict=var_dict)
-
-        # fcn16s is calculated also when scale_min is *8, because we need to calculate fuse_pool4 anyway
-        if scale_min == 'fcn16s' or scale_min == 'fcn8s':
-            upscore_fr_2s = nn.upscore_layer(model['score_fr'], feed_dict, "upscore_fr_2s",
-                                           tf.shape(model['pool4']), num_classes,
-                                           ksize=4, stride=2, var_dict=var_dict)
- 
-            # Fuse fc8 *2, pool4
-            in_features = model['pool4'].get_shape()[3].value
-            score_pool4 = nn.conv_layer(model['pool4'], feed_dict, "score_pool4", 
-                                        shape=[1, 1, in_features, num_classes], 
-                                        relu=False, dropout=False, var_dict=var_dict)
-            
-            fuse_pool4 = tf.add(upscore_fr_2s, score_pool4)
+        if features is None:
+            model = build_vgg16_trunk(image, feed_dict, is_train=is_train, var_dict=var_dict, defer_init=self.defer_init,
+                                      checkpoint_blocks=checkpoint_blocks)
+        else:
+            # Cached trunk outputs 'pool3', 'pool4', 'conv7', only the head is built
+            model = dict(features)
+            if is_train:
+                # conv7 is followed by dropout during training
+                model['conv7'] = tf.nn.dropout(model['conv7'], 0.5)
+        if image_shape is None:
+            image_shape = tf.shape(image)
+        model = build_fcn_head(model, image_shape, feed_dict, num_classes, scale_min=scale_min,
+                               outputs=outputs, var_dict=var_dict, defer_init=self.defer_init,
+                               separable_upscore=separable_upscore, lowres_outputs=lowres_outputs)
 
-            # Upsample fusion *16
-            model['fcn16s'] = nn.upscore_layer(fuse_pool4, feed_dict, "upscore_pool4_16s",
-                                               tf.shape(image), num_classes,
-                                               ksize=32, stride=16, var_dict=var_dict)
-            
-        # fcn8s is calculated only when scale_min is *8
-        if scale_min == 'fcn8s':
-            # Upsample fc8 *4
-            upscore_pool4_2s = nn.upscore_layer(fuse_pool4, feed_dict, "upscore_pool4_2s",
-                                                tf.shape(model['pool3']), num_classes,
-                                                ksize=4, stride=2, var_dict=var_dict)
-
-            # Fuse fc8 *4, pool4 *2, pool3            
-            in_features = model['pool3'].get_shape()[3].value
-            score_pool3 = nn.conv_layer(model['pool3'], self.data_dict, "score_pool3", 
-                                        shape=[1, 1, in_features, num_classes], 
-                                        relu=False, dropout=False, var_dict=var_dict)
-
-            fuse_pool3 = tf.add(score_pool3, upscore_pool4_2s)
-
-            # Upsample fusion *8
-            model['fcn8s'] = nn.upscore_layer(fuse_pool3, feed_dict, "upscore8",
-                                              tf.shape(image), num_classes,
-                                              ksize=16, stride=8, var_dict=var_dict)
-         
         #self.var_dict = var_dict
+        self.pretrained_weights += tf.get_collection(nn.PRETRAINED_WEIGHTS)[num_weights:]
         print('Model with scale %s is builded successfully!' % scale_min)
         print('Model: %s' % str(model.keys()))
         return model
 
-    def inference(self, image, num_classes, scale_min='fcn16s', option={'fcn32s':False, 'fcn16s':True, 'fcn8s':False}):
-        # Build model
-        model = self._build_model(image, num_classes, is_train=False, scale_min=scale_min)
+    def inference(self, image, num_classes, scale_min='fcn16s', option={'fcn32s':False, 'fcn16s':True, 'fcn8s':False},
+                  separable_upscore=False):
+        # Build model, only the requested scales are upsampled
+        outputs = [scale for scale in option.keys() if option[scale]]
+        model = self._build_model(image, num_classes, is_train=False, scale_min=scale_min, outputs=outputs,
+                                  separable_upscore=separable_upscore)
         
         # Keep using dictionary incase we want to compare results between different scales
         predict = {}
@@ -149,21 +265,114 @@ class FCN16VGG:
 
         return predict
 
-    def train(self, params, image, truth, scale_min='fcn16s', save_var=True):
+    def inference_scores(self, image, num_classes, scale='fcn8s', separable_upscore=False):
+        '''
+        Return: full resolution scores of the given scale before the argmax, shape [batch, h, w, num_classes],
+                e.g for blending overlapping tiles in network.tiled_inference
+        '''
+        model = self._build_model(image, num_classes, is_train=False, scale_min=scale, outputs=[scale],
+                                  separable_upscore=separable_upscore)
+        return model[scale]
+
+    def inference_activations(self, image, num_classes, names, scale='fcn8s'):
+        '''
+        Return: {name: tensor} of the given layer outputs, e.g the inputs of the layers
+                to calibrate in compression.quantize_weights()
+        '''
+        model = self._build_model(image, num_classes, is_train=False, scale_min=scale, outputs=[scale])
+        return dict((name, model[name]) for name in names)
+
+    def inference_lowres(self, image, num_classes, scale='fcn8s'):
+        '''
+        Build the model without the final full resolution upsampling.
+        Return: low resolution scores of the given scale, shape [batch, h, w, num_classes].
+        Decode them with nn.upsample_argmax(scores[0], height, width, ksize, stride)
+        where (ksize, stride) = LOWRES_SCORES[scale][1:], which gives the bilinear
+        upscore + argmax result tile by tile instead of a full resolution score stack.
+        '''
+        model = self._build_model(image, num_classes, is_train=False, scale_min=scale, outputs=[],
+                                  lowres_outputs=[scale])
+        return model[LOWRES_SCORES[scale][0]]
+
+    def train(self, params, image, truth, scale_min='fcn16s', save_var=True, lowres_loss=False, label_downsample='nearest',
+              checkpoint_blocks=(), accum_steps=1):
         '''
         Note Dtype:
         image: reshaped image value, shape=[1, Height, Width, 3], tf.float32, numpy ndarray
         truth: reshaped image label, shape=[Height*Width], tf.int32, numpy ndarray
+        Both can be placeholders or the tensors of dataset.input_queue.input_queue()
+        lowres_loss: compute the loss on the low resolution scores of scale_min (LOWRES_SCORES,
+                     output stride 32, 16 or 8) against downsampled labels, the final upscore layer
+                     is not built. Its kernel is then not saved, i.e. bilinear, and can be
+                     fine-tuned in a later full resolution stage.
+        label_downsample: 'nearest' or 'majority', see nn.downsample_labels()
+        checkpoint_blocks: VGG16 blocks (1 ... 5) recomputed in the backward pass instead of storing
+                           their activations, e.g [1, 2, 3, 4, 5] trades roughly one more trunk forward
+                           pass per step for the memory of the full resolution activations.
+        accum_steps: if > 1, average the gradients of accum_steps micro-batches before every update,
+                     the returned train_step is then a nn.GradientAccumulator, run it with
+                     train_step.step(session, feed_dict)
+        '''
+        return self._train(params, image, tf.shape(image), truth, scale_min, save_var, lowres_loss, label_downsample,
+                           checkpoint_blocks=checkpoint_blocks, accum_steps=accum_steps)
+
+    def train_head(self, params, features, image_shape, truth, scale_min='fcn16s', save_var=True, lowres_loss=False,
+                   label_downsample='nearest'):
         '''
-        # Build model
-        model = self._build_model(image, params['num_classes'], is_train=True, scale_min=scale_min, save_var=save_var) 
-        upscored = model[scale_min]
+        Train only the skip head on cached outputs of a frozen trunk, see data_utils.FeatureCache.
+        features: {'pool3', 'pool4', 'conv7'} trunk outputs, shape [1, h, w, channels], tf.float32
+        image_shape: [1, Height, Width, 3] of the image the features come from, tf.int32
+        Other arguments as in train(), var_dict only holds the head layers.
+        '''
+        return self._train(params, None, image_shape, truth, scale_min, save_var, lowres_loss, label_downsample,
+                           features=features)
+
+    def gradients(self, params, image, truth, optimizer, scale_min='fcn16s', save_var=True, lowres_loss=False,
+                  label_downsample='nearest', checkpoint_blocks=()):
+        '''
+        Build the model and loss as train() does, without the update.
+        Return: (grads_and_vars, loss), e.g for averaging the gradients of several towers in network.multi_tower
+        '''
+        return self._gradients(params, image, tf.shape(image), truth, optimizer, scale_min, save_var, lowres_loss,
+                               label_downsample, checkpoint_blocks=checkpoint_blocks)
+
+    def _gradients(self, params, image, image_shape, truth, optimizer, scale_min, save_var, lowres_loss, label_downsample,
+                   features=None, checkpoint_blocks=()):
+        if lowres_loss:
+            (score_name, ksize, stride) = LOWRES_SCORES[scale_min]
+            model = self._build_model(image, params['num_classes'], is_train=True, scale_min=scale_min, save_var=save_var,
+                                      outputs=[], lowres_outputs=[scale_min], features=features, image_shape=image_shape,
+                                      checkpoint_blocks=checkpoint_blocks)
+            upscored = model[score_name]
+            truth = tf.reshape(truth, tf.pack([image_shape[0], image_shape[1], image_shape[2], 1]))
+            truth = nn.downsample_labels(truth, stride, tf.shape(upscored)[1:3], params['num_classes'], method=label_downsample)
+            truth = tf.reshape(truth, [-1])
+        else:
+            # Build model
+            model = self._build_model(image, params['num_classes'], is_train=True, scale_min=scale_min, save_var=save_var,
+                                      features=features, image_shape=image_shape, checkpoint_blocks=checkpoint_blocks)
+            upscored = model[scale_min]
         old_shape = tf.shape(upscored)
         new_shape = [old_shape[0]*old_shape[1]*old_shape[2], params['num_classes']]
         prediction = tf.reshape(upscored, new_shape)
 
         loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(prediction, truth))
-        train_step = tf.train.AdamOptimizer(params['rate']).minimize(loss)
+        if model.has_key('checkpoints'):
+            grads_and_vars = nn.checkpointed_gradients(loss, model['checkpoints'])
+        else:
+            grads_and_vars = optimizer.compute_gradients(loss)
+        return grads_and_vars, loss
+
+    def _train(self, params, image, image_shape, truth, scale_min, save_var, lowres_loss, label_downsample, features=None,
+               checkpoint_blocks=(), accum_steps=1):
+        optimizer = tf.train.AdamOptimizer(params['rate'])
+        (grads_and_vars, loss) = self._gradients(params, image, image_shape, truth, optimizer, scale_min, save_var,
+                                                 lowres_loss, label_downsample, features=features,
+                                                 checkpoint_blocks=checkpoint_blocks)
+        if accum_steps > 1:
+            train_step = nn.GradientAccumulator(optimizer, grads_and_vars, accum_steps)
+        else:
+            train_step = optimizer.apply_gradients(grads_and_vars)
 
         return train_step, loss
 
@@ -0,0 +1,96 @@
+"""Export of inference graphs with frozen weights and the loader serving from them.
+The exported GraphDef holds only the ops needed for the named outputs, with every
+variable replaced by a constant, so starting from it skips building the model
+in python, loading the weight dict and initializing the variables.
+The graph is then rewritten for inference by optimize_for_inference_lib: training-only
+nodes (Identity, CheckNumerics) are removed and batch norms are folded into the
+convolutions. The graph_transforms constant folding is not part of TF 0.12.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+from tensorflow.python.tools import optimize_for_inference_lib
+
+INPUT_NAME = 'image'
+
+
+def export_frozen_graph(session, outputs, export_path):
+    '''
+    session: session holding the built and initialized model
+    outputs: {output_name: tensor}, e.g {'fcn8s': predict['fcn8s']}.
+             Every tensor is renamed to output_name with tf.identity.
+             The model input must be the placeholder named INPUT_NAME.
+    export_path: file the frozen GraphDef is written to, e.g ../data/frozen/fcn8s.pb
+    '''
+    graph = session.graph
+    with graph.as_default():
+        for (name, tensor) in outputs.items():
+            if tf.identity(tensor, name=name).op.name != name:
+                raise ValueError('Output name %s is already used in the graph.' % name)
+    output_names = list(outputs.keys())
+
+    # Variables -> constants, only the subgraph reaching the outputs is kept,
+    # i.e. the optimizer, summaries and weight assign ops are dropped
+    graph_def = graph_util.convert_variables_to_constants(session, graph.as_graph_def(), output_names)
+    graph_def = optimize_graph(graph_def, output_names)
+
+    with tf.gfile.GFile(export_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('Frozen graph with outputs %s saved to %s (%d ops)' % (str(output_names), export_path, len(graph_def.node)))
+
+
+def optimize_graph(graph_def, output_names):
+    '''
+    Return: graph_def rewritten by optimize_for_inference_lib with INPUT_NAME as float32 input.
+            The output Identity nodes would be spliced out by it, so the graph is optimized up to
+            the ops they forward and the outputs are added back afterwards to keep their names.
+    '''
+    nodes = dict((node.name, node) for node in graph_def.node)
+    sources = {}
+    for name in output_names:
+        source = nodes[name].input[0]
+        while nodes[source.split(':')[0]].op == 'Identity':
+            source = nodes[source.split(':')[0]].input[0]
+        sources[name] = source
+    source_names = list(set(source.split(':')[0] for source in sources.values()))
+
+    optimized = optimize_for_inference_lib.optimize_for_inference(graph_def, [INPUT_NAME], source_names,
+                                                                   tf.float32.as_datatype_enum)
+    for name in output_names:
+        output = optimized.node.add()
+        output.CopyFrom(nodes[name])
+        output.input[0] = sources[name]
+    return optimized
+
+
+class FrozenModel:
+
+    def __init__(self, export_path, output_names, config=None):
+        '''
+        Load a graph written by export_frozen_graph() into its own graph and session.
+        output_names: outputs to fetch, subset of the exported ones
+        '''
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(export_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            elements = tf.import_graph_def(graph_def, name='',
+                                           return_elements=[INPUT_NAME + ':0'] + [name + ':0' for name in output_names])
+        self.image = elements[0]
+        self.outputs = dict(zip(output_names, elements[1:]))
+        self.session = tf.Session(graph=self.graph, config=config)
+
+    def run(self, image):
+        '''
+        image: [batch, H, W, 3] BGR float32, as returned by CityDataSet.next_batch()
+        Return: {output_name: value}
+        '''
+        return self.session.run(self.outputs, feed_dict={self.image: image})
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,60 @@
+"""Synchronous data-parallel training with one model replica (tower) per local device.
+Every tower builds the model on its own inputs with shared variables, the gradients of
+all towers are averaged and applied by a single optimizer update, i.e. one step trains
+on num_towers images. On a CPU-only machine the towers run on the CPU devices created
+by session_config(num_towers).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+def session_config(num_devices, threads_per_device=None):
+    '''
+    Return: tf.ConfigProto exposing num_devices CPU devices '/cpu:0' ... so that the towers
+            run concurrently, with threads_per_device intra-op threads each if given
+    '''
+    config = tf.ConfigProto(device_count={'CPU': num_devices}, allow_soft_placement=True)
+    if threads_per_device is not None:
+        config.intra_op_parallelism_threads = threads_per_device
+        config.inter_op_parallelism_threads = num_devices
+    return config
+
+def cpu_devices(num_devices):
+    return ['/cpu:%d' % i for i in range(num_devices)]
+
+def average_gradients(tower_grads):
+    '''
+    tower_grads: list of grads_and_vars per tower, over the same variables
+    Return: grads_and_vars with the gradients averaged over the towers
+    '''
+    averaged = []
+    for grads_and_vars in zip(*tower_grads):
+        var = grads_and_vars[0][1]
+        grads = [tf.convert_to_tensor(grad) for (grad, v) in grads_and_vars if grad is not None]
+        if not grads:
+            continue
+        averaged.append((tf.add_n(grads) / len(grads), var))
+    return averaged
+
+def build_towers(tower_fn, devices):
+    '''
+    tower_fn(i): build tower i and return its (grads_and_vars, loss), e.g
+                 lambda i: fcn.gradients(params, images[i], truths[i], optimizer, save_var=(i == 0)).
+                 Called with variable reuse for every tower but the first one.
+    devices: one device per tower, e.g cpu_devices(4)
+    Return: (averaged grads_and_vars, mean loss), apply the gradients with the optimizer
+    '''
+    tower_grads = []
+    losses = []
+    with tf.variable_scope(tf.get_variable_scope()):
+        for (i, device) in enumerate(devices):
+            with tf.device(device), tf.name_scope('tower_%d' % i):
+                (grads_and_vars, loss) = tower_fn(i)
+                # The next towers share the variables of the first one
+                tf.get_variable_scope().reuse_variables()
+            tower_grads.append(grads_and_vars)
+            losses.append(loss)
+    with tf.device(devices[0]):
+        return average_gradients(tower_grads), tf.add_n(losses) / len(losses)
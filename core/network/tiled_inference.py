@@ -0,0 +1,121 @@
+"""Sliding window inference for inputs larger than what fits in memory at once.
+The network is built once on a fixed tile size [None, tile_h, tile_w, 3]. Tiles are
+run in batches and their full resolution scores are blended with linear weights
+in the overlaps. Blended rows are argmaxed as soon as no further tile touches them,
+so the activations are bounded by batch_size tiles and the score buffer by
+tile_h x image width, whatever the image height.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def get_tile_starts(size, tile, stride):
+    '''Start offsets of the tiles along one axis, the last tile ends at size'''
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, stride))
+    starts.append(size - tile)
+    return starts
+
+def get_blend_weights(tile_h, tile_w, overlap):
+    '''[tile_h, tile_w, 1] weights rising linearly over the overlap at every tile border'''
+    def ramp(size):
+        x = np.arange(size, dtype=np.float32)
+        return np.minimum(1.0, np.minimum(x + 1, size - x) / (overlap + 1))
+    return (ramp(tile_h)[:, np.newaxis] * ramp(tile_w)[np.newaxis, :])[..., np.newaxis]
+
+
+class TiledInference:
+
+    def __init__(self, session, image, scores, tile_size=(512, 512), overlap=64, batch_size=4, num_groups=1):
+        '''
+        session: session holding the initialized model
+        image: input placeholder of the model, shape [None, tile_h, tile_w, 3]
+        scores: full resolution scores of the model for image, shape [None, tile_h, tile_w, channels],
+                e.g FCN16VGG.inference_scores() or InstanceFCN8s.inference_scores()
+        overlap: pixels shared by neighbouring tiles, scores are blended over it
+        batch_size: number of tiles per sess.run
+        num_groups: channels are split in num_groups equal groups and argmaxed separately,
+                    e.g num_pred_class for the stacked instance masks
+        '''
+        if overlap * 2 > min(tile_size):
+            raise ValueError('Overlap %d is too large for tiles of size %s' % (overlap, str(tile_size)))
+        self.session = session
+        self.image = image
+        self.scores = scores
+        (self.tile_h, self.tile_w) = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.num_groups = num_groups
+        self.weights = get_blend_weights(self.tile_h, self.tile_w, overlap)
+
+    def _run_tiles(self, tiles):
+        '''Run the model on a list of [tile_h, tile_w, 3] tiles, batch_size at a time'''
+        out = []
+        for b in range(0, len(tiles), self.batch_size):
+            batch = np.stack(tiles[b:b+self.batch_size])
+            out.extend(self.session.run(self.scores, feed_dict={self.image: batch}))
+        return out
+
+    def _argmax(self, scores):
+        (rows, width, channels) = scores.shape
+        grouped = scores.reshape(rows, width, self.num_groups, channels // self.num_groups)
+        labels = np.argmax(grouped, axis=3)
+        if self.num_groups == 1:
+            labels = labels[:, :, 0]
+        return labels
+
+    def predict(self, image):
+        '''
+        image: [1, height, width, 3] or [height, width, 3], as returned by CityDataSet.next_batch()
+        Return: int64 label map [height, width] ([height, width, num_groups] if num_groups > 1)
+        '''
+        if image.ndim == 4:
+            image = image[0]
+        (height, width) = image.shape[:2]
+        # Images smaller than a tile are padded by repeating the border pixels
+        pad_h = max(self.tile_h - height, 0)
+        pad_w = max(self.tile_w - width, 0)
+        if pad_h or pad_w:
+            image = np.pad(image, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+        (full_h, full_w) = image.shape[:2]
+
+        stride_h = self.tile_h - self.overlap
+        stride_w = self.tile_w - self.overlap
+        starts_y = get_tile_starts(full_h, self.tile_h, stride_h)
+        starts_x = get_tile_starts(full_w, self.tile_w, stride_w)
+
+        labels = None
+        acc = None
+        acc_top = 0
+        for y in starts_y:
+            tiles = [image[y:y+self.tile_h, x:x+self.tile_w] for x in starts_x]
+            tile_scores = self._run_tiles(tiles)
+            if acc is None:
+                channels = tile_scores[0].shape[2]
+                acc = np.zeros((self.tile_h, full_w, channels), dtype=np.float32)
+                wsum = np.zeros((self.tile_h, full_w, 1), dtype=np.float32)
+
+            # Rows above y are not touched by this or any later tile row
+            shift = y - acc_top
+            if shift > 0:
+                done = self._argmax(acc[:shift] / wsum[:shift])
+                if labels is None:
+                    labels = np.zeros((full_h, full_w) + done.shape[2:], dtype=np.int64)
+                labels[acc_top:y] = done
+                acc = np.concatenate([acc[shift:], np.zeros_like(acc[:shift])])
+                wsum = np.concatenate([wsum[shift:], np.zeros_like(wsum[:shift])])
+                acc_top = y
+
+            for (x, scores) in zip(starts_x, tile_scores):
+                acc[:, x:x+self.tile_w] += scores * self.weights
+                wsum[:, x:x+self.tile_w] += self.weights
+
+        done = self._argmax(acc / wsum)
+        if labels is None:
+            labels = np.zeros((full_h, full_w) + done.shape[2:], dtype=np.int64)
+        labels[acc_top:] = done[:full_h - acc_top]
+        return labels[:height, :width]
@@ -9,6 +9,10 @@ from __future__ import print_function
 import tensorflow as tf
 import numpy as np
 from math import ceil
+from scipy import ndimage
+
+# Graph collection of PretrainedWeight, i.e. variables whose value comes from a weight dict
+PRETRAINED_WEIGHTS = 'pretrained_weights'
 
 
 def max_pool_layer(x, name, stride=2):
@@ -17,12 +21,22 @@ def max_pool_layer(x, name, stride=2):
                           padding='SAME', name=name)
     return pool
 
-def conv_layer(x, feed_dict, name, stride=1, shape=None, relu=True, dropout=False, keep_prob=0.5, var_dict=None):
+def conv_layer(x, feed_dict, name, stride=1, shape=None, relu=True, dropout=False, keep_prob=0.5, var_dict=None, defer_init=False,
+               stddev=None):
+    '''
+    stddev: if given, a kernel missing in feed_dict is drawn from a truncated normal with this
+            stddev instead of zeros, e.g (2/fan_in)**0.5 for layers trained from scratch
+    '''
+
+    if not feed_dict.has_key(name) and feed_dict.has_key(name + '_u'):
+        # Factorized by compression.factorize_weights()
+        return lowrank_conv_layer(x, feed_dict, name, stride=stride, relu=relu, dropout=dropout,
+                                  keep_prob=keep_prob, var_dict=var_dict, defer_init=defer_init)
 
     with tf.variable_scope(name) as scope:
         print('Layer name: %s' % name)  
-        kernel = get_conv_kernel(feed_dict, name, shape)
-        bias = get_bias(feed_dict, name, shape)
+        kernel = get_conv_kernel(feed_dict, name, shape, defer_init=defer_init, stddev=stddev)
+        bias = get_bias(feed_dict, name, shape, defer_init=defer_init)
 
         conv = tf.nn.conv2d(x, kernel,
                             strides=[1, stride, stride, 1],
@@ -39,7 +53,17 @@ def conv_layer(x, feed_dict, name, stride=1, shape=None, relu=True, dropout=Fals
 
     return conv_out
 
-def mask_layer(x, feed_dict, name, shape, stride=1, relu=False, dropout=False, keep_prob=0.5, var_dict=None):
+def lowrank_conv_layer(x, feed_dict, name, stride=1, relu=True, dropout=False, keep_prob=0.5, var_dict=None, defer_init=False):
+    '''
+    Conv layer stored as two thinner convs name+'_u' [h, w, in, rank] and name+'_v' [1, 1, rank, out],
+    the activation is only applied after the second one.
+    '''
+    conv_u = conv_layer(x, feed_dict, name + '_u', stride=stride, relu=False,
+                        var_dict=var_dict, defer_init=defer_init)
+    return conv_layer(conv_u, feed_dict, name + '_v', relu=relu, dropout=dropout, keep_prob=keep_prob,
+                      var_dict=var_dict, defer_init=defer_init)
+
+def mask_layer(x, feed_dict, name, shape, stride=1, relu=False, dropout=False, keep_prob=0.5, var_dict=None, defer_init=False):
     '''
     Input
     x: a stack of semantic mask with shape [batch, height, width, num_classes]
@@ -54,8 +78,8 @@ def mask_layer(x, feed_dict, name, shape, stride=1, relu=False, dropout=False, k
     with tf.variable_scope(name) as scope:
         print('Layer name: %s' % name)  
      
-        kernel = get_mask_conv_kernel(feed_dict, name, shape)
-        bias = get_bias(feed_dict, name, [1, 1, 1, shape[2]*shape[3]])
+        kernel = get_mask_conv_kernel(feed_dict, name, shape, defer_init=defer_init)
+        bias = get_bias(feed_dict, name, [1, 1, 1, shape[2]*shape[3]], defer_init=defer_init)
 
         conv = tf.nn.depthwise_conv2d(x, kernel,
                                       strides=[1, stride, stride, 1],
@@ -75,7 +99,13 @@ def mask_layer(x, feed_dict, name, shape, stride=1, relu=False, dropout=False, k
 
 
 # Use existing code, still don't understand. Prefer to use upscore_layer() first.
-def upscore_layer(x, feed_dict, name, shape, num_class, ksize=4, stride=2, var_dict=None):
+def upscore_layer(x, feed_dict, name, shape, num_class, ksize=4, stride=2, var_dict=None, defer_init=False, separable=False):
+    '''
+    separable: if the kernel is (or would be initialized to) the fixed diagonal bilinear kernel,
+               run it as per-channel separable upsampling instead of a dense
+               [ksize, ksize, num_class, num_class] conv2d_transpose, see bilinear_upscore().
+               No variable is created for the layer then, so only use it for inference.
+    '''
     strides = [1, stride, stride, 1]
     with tf.variable_scope(name):
         print('Layer name: %s' % name)          
@@ -96,7 +126,11 @@ def upscore_layer(x, feed_dict, name, shape, num_class, ksize=4, stride=2, var_d
         num_input = ksize * ksize * in_features / stride
         stddev = (2 / num_input)**0.5
 
-        kernel = get_deconv_kernel(feed_dict, name, f_shape)
+        if separable and is_fixed_bilinear(feed_dict, name, f_shape):
+            print('Use separable bilinear upsampling for %s' % name)
+            return bilinear_upscore(x, new_shape, ksize, stride)
+
+        kernel = get_deconv_kernel(feed_dict, name, f_shape, defer_init=defer_init)
         deconv = tf.nn.conv2d_transpose(x, kernel, output_shape,
                                         strides=strides, padding='SAME')
     if var_dict is not None:
@@ -104,7 +138,150 @@ def upscore_layer(x, feed_dict, name, shape, num_class, ksize=4, stride=2, var_d
 
     return deconv
 
-def get_mask_conv_kernel(feed_dict, feed_name, shape):
+class PretrainedWeight(object):
+    '''
+    Links a variable to its entry in a weight dict, e.g feed_dict['conv1_1'][0],
+    so that its value can be (re)assigned after the graph is built, see assign_weights().
+    index: position in the (kernel, bias) tuple, None if the entry is a bare array
+    default: callable returning the value to use when the entry is missing, or None to keep the variable as is
+    '''
+    def __init__(self, var, feed_name, index=None, default=None):
+        self.var = var
+        self.name = var.op.name
+        self.feed_name = feed_name
+        self.index = index
+        self.default = default
+        self.placeholder = None
+        self.assign_op = None
+
+    def value(self, feed_dict):
+        if not feed_dict.has_key(self.feed_name):
+            if self.default is None:
+                return None
+            return self.default()
+        value = feed_dict[self.feed_name]
+        if self.index is not None:
+            value = value[self.index]
+        return value
+
+def add_pretrained_weight(var, feed_name, index=None, default=None):
+    if tf.get_variable_scope().reuse:
+        # Layer built again on existing variables, e.g recomputed by checkpointed_gradients()
+        return
+    tf.add_to_collection(PRETRAINED_WEIGHTS, PretrainedWeight(var, feed_name, index, default))
+
+def pretrained_initializer(value, defer_init=False, dtype=tf.float32):
+    '''
+    With defer_init only the shape of value is used: the variable is zero-initialized and
+    the value is assigned later by assign_weights(), which keeps it out of the GraphDef.
+    '''
+    if defer_init:
+        return tf.constant_initializer(value=0, dtype=dtype)
+    return tf.constant_initializer(value=value, dtype=dtype)
+
+def assign_weights(session, feed_dict, weights=None):
+    '''
+    Assign the given PretrainedWeight list (all registered ones by default) from feed_dict.
+    Values are fed through placeholders one layer at a time, so nothing is embedded into
+    the graph and at most one layer is copied at once. The placeholder and assign op of
+    a variable are created on first use and reused afterwards.
+    '''
+    if weights is None:
+        weights = tf.get_collection(PRETRAINED_WEIGHTS)
+    for weight in weights:
+        value = weight.value(feed_dict)
+        if value is None:
+            print('No value for %s, keep current value' % weight.name)
+            continue
+        if weight.assign_op is None:
+            with weight.var.graph.as_default():
+                weight.placeholder = tf.placeholder(weight.var.dtype.base_dtype, shape=weight.var.get_shape())
+                weight.assign_op = tf.assign(weight.var, weight.placeholder)
+        session.run(weight.assign_op, feed_dict={weight.placeholder: value})
+
+def checkpointed_gradients(loss, segments, var_list=None):
+    '''
+    Gradients of loss with the activations of the given segments recomputed during the backward
+    pass instead of kept from the forward pass (gradient checkpointing).
+    segments: list of (prev_out, seg_in, seg_out, rebuild) in forward order, where
+              seg_in = tf.stop_gradient(prev_out), seg_out is the stop_gradient of the segment
+              output computed from seg_in and rebuild(x) builds the segment again on x with
+              the same variables, see fcn_vgg16.build_vgg16_trunk(checkpoint_blocks=...).
+              The segments must be deterministic, i.e. without dropout.
+    Only the segment inputs and outputs are held until the backward pass. The recomputation of
+    a segment waits for the gradient of its output, so segments are rebuilt one at a time.
+    Return: list of (gradient, variable) for optimizer.apply_gradients()
+    '''
+    if var_list is None:
+        var_list = tf.trainable_variables()
+    grads = {}
+    def add(values):
+        for (var, grad) in zip(var_list, values):
+            if grad is not None:
+                grads[var] = grads[var] + grad if grads.has_key(var) else grad
+
+    # Everything after the segments, and the direct gradients of the segment outputs,
+    # e.g through the skip connections of 'pool3' and 'pool4'
+    num_segments = len(segments)
+    values = tf.gradients(loss, [segment[2] for segment in segments] + var_list)
+    out_grads = values[:num_segments]
+    add(values[num_segments:])
+
+    for i in reversed(range(num_segments)):
+        (prev_out, seg_in, seg_out, rebuild) = segments[i]
+        if out_grads[i] is None:
+            continue
+        with tf.control_dependencies([out_grads[i]]):
+            x = tf.identity(seg_in)
+        values = tf.gradients(rebuild(x), [x] + var_list, grad_ys=out_grads[i])
+        add(values[1:])
+        # Back through the layers between the previous segment (if any) and this one
+        stops = [segments[i-1][2]] if i > 0 else []
+        values = tf.gradients(prev_out, stops + var_list, grad_ys=values[0])
+        add(values[len(stops):])
+        if i > 0 and values[0] is not None:
+            out_grads[i-1] = values[0] if out_grads[i-1] is None else out_grads[i-1] + values[0]
+    return [(grads[var], var) for var in var_list if grads.has_key(var)]
+
+class GradientAccumulator(object):
+    '''
+    Sum the gradients of several micro-batches into non-trainable variables and apply
+    their mean once, i.e. an effective batch of num_steps images at the memory of one.
+    accum_op: add the gradients of the fed micro-batch, returns the number of accumulated micro-batches
+    apply_op: apply the accumulated sum divided by that number with the optimizer, then reset
+    global_step: number of applied updates, micro_step: micro-batches accumulated since the last one
+    Use step() in the training loop instead of session.run(train_op).
+    '''
+    def __init__(self, optimizer, grads_and_vars, num_steps):
+        self.num_steps = num_steps
+        grads_and_vars = [(grad, var) for (grad, var) in grads_and_vars if grad is not None]
+        with tf.name_scope('grad_accum'):
+            self.micro_step = tf.Variable(0, trainable=False, name='micro_step')
+            self.global_step = tf.Variable(0, trainable=False, name='global_step')
+            accums = [tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False,
+                                  name=var.op.name.replace('/', '_')) for (grad, var) in grads_and_vars]
+            add_ops = [tf.assign_add(accum, tf.convert_to_tensor(grad)) for (accum, (grad, var)) in zip(accums, grads_and_vars)]
+            with tf.control_dependencies(add_ops):
+                self.accum_op = tf.assign_add(self.micro_step, 1)
+
+            count = tf.cast(tf.maximum(self.micro_step, 1), tf.float32)
+            mean_grads = [(accum / count, var) for (accum, (grad, var)) in zip(accums, grads_and_vars)]
+            update = optimizer.apply_gradients(mean_grads, global_step=self.global_step)
+            with tf.control_dependencies([update]):
+                reset_ops = [tf.assign(accum, tf.zeros_like(accum)) for accum in accums]
+                self.apply_op = tf.group(tf.assign(self.micro_step, 0), *reset_ops)
+
+    def step(self, session, feed_dict=None):
+        '''
+        Accumulate one micro-batch and apply once num_steps of them have been accumulated.
+        Return: True if the variables were updated
+        '''
+        if session.run(self.accum_op, feed_dict=feed_dict) < self.num_steps:
+            return False
+        session.run(self.apply_op)
+        return True
+
+def get_mask_conv_kernel(feed_dict, feed_name, shape, defer_init=False):
     if not feed_dict.has_key(feed_name):
         print("No matched kernel %s, randomly initialize the kernel with shape: %s " % (feed_name, str(shape)))
         init = tf.constant_initializer(value=0, dtype=tf.float32)
@@ -112,25 +289,48 @@ def get_mask_conv_kernel(feed_dict, feed_name, shape):
         kernel = feed_dict[feed_name][0]
         shape = kernel.shape
         print('Load kernel with shape: %s' % str(shape))
-        init = tf.constant_initializer(value=kernel,dtype=tf.float32)
+        init = pretrained_initializer(kernel, defer_init)
     var = tf.get_variable(name="kernel", initializer=init, shape=shape)
+    add_pretrained_weight(var, feed_name, 0)
     return var
 
 
-def get_conv_kernel(feed_dict, feed_name, shape):
+def get_conv_kernel(feed_dict, feed_name, shape, defer_init=False, stddev=None):
+    if feed_dict.has_key(feed_name) and len(feed_dict[feed_name]) == 3:
+        return get_quantized_conv_kernel(feed_dict, feed_name, defer_init=defer_init)
     if not feed_dict.has_key(feed_name):
         print("No matched kernel %s, randomly initialize the kernel with shape: %s " % (feed_name, str(shape)))
-        init = tf.constant_initializer(value=0, dtype=tf.float32)
+        if stddev is None:
+            init = tf.constant_initializer(value=0, dtype=tf.float32)
+        else:
+            init = tf.truncated_normal_initializer(stddev=stddev, dtype=tf.float32)
 	#init = tf.truncated_normal_initializer(stddev=0.001, dtype=tf.float32)
     else:
         kernel = feed_dict[feed_name][0]
         shape = kernel.shape
         print('Load kernel with shape: %s' % str(shape))
-        init = tf.constant_initializer(value=kernel,dtype=tf.float32)
+        init = pretrained_initializer(kernel, defer_init)
     var = tf.get_variable(name="kernel", initializer=init, shape=shape)
+    add_pretrained_weight(var, feed_name, 0)
     return var
 
-def get_bias(feed_dict, feed_name, shape):
+def get_quantized_conv_kernel(feed_dict, feed_name, defer_init=False):
+    '''
+    Kernel of a layer quantized by compression.quantize_weights(), i.e. stored as
+    (int8 kernel, bias, per output channel scale). The int8 kernel is kept in an int8
+    variable and dequantized in the graph: kernel = kernel_q * scale
+    '''
+    (kernel_q, bias, scale) = feed_dict[feed_name]
+    print('Load int8 kernel with shape: %s' % str(kernel_q.shape))
+    init = pretrained_initializer(kernel_q, defer_init, dtype=tf.int8)
+    var_q = tf.get_variable(name="kernel_q", initializer=init, shape=kernel_q.shape, dtype=tf.int8, trainable=False)
+    add_pretrained_weight(var_q, feed_name, 0)
+    init = pretrained_initializer(scale, defer_init)
+    var_scale = tf.get_variable(name="scale", initializer=init, shape=scale.shape, trainable=False)
+    add_pretrained_weight(var_scale, feed_name, 2)
+    return tf.mul(tf.cast(var_q, tf.float32), var_scale)
+
+def get_bias(feed_dict, feed_name, shape, defer_init=False):
     if not feed_dict.has_key(feed_name):
         shape = [shape[3]]        
         print("No matched bias %s, randomly initialize the bias with shape: %s " % (feed_name, str(shape)))
@@ -139,35 +339,241 @@ def get_bias(feed_dict, feed_name, shape):
         bias = feed_dict[feed_name][1]
         shape = bias.shape
         print('Load bias with shape: %s' % str(shape))
-        init = tf.constant_initializer(value=bias, dtype=tf.float32)        
+        init = pretrained_initializer(bias, defer_init)
         
     var = tf.get_variable(name="bias", initializer=init, shape=shape)
+    add_pretrained_weight(var, feed_name, 1)
     return var
-    
-def get_deconv_kernel(feed_dict, feed_name, f_shape):
+
+def get_bilinear_filter(ksize):
+    '''1-D bilinear interpolation filter, get_bilinear_kernel() is its outer product with itself'''
+    f = ceil(ksize/2.0)
+    c = (2 * f - 1 - f % 2) / (2.0 * f)
+    return 1 - np.abs(np.arange(ksize) / f - c)
+
+def get_bilinear_kernel(f_shape):
+    # Bilinear interpolation on the diagonal, i.e. every class is upsampled separately
+    filt = get_bilinear_filter(f_shape[0])
+    bilinear = np.outer(filt, filt)
+    kernel = np.zeros(f_shape)
+    for i in range(f_shape[2]):
+        kernel[:, :, i, i] = bilinear
+    return kernel
+
+def is_fixed_bilinear(feed_dict, feed_name, f_shape):
+    '''
+    True if get_deconv_kernel() would produce the diagonal bilinear kernel, i.e. the kernel
+    is missing in feed_dict (bilinear initialization) or the stored kernel is still bilinear.
+    '''
+    if f_shape[2] != f_shape[3]:
+        return False
+    if not feed_dict.has_key(feed_name):
+        return True
+    kernel = feed_dict[feed_name]
+    if list(kernel.shape) != list(f_shape):
+        return False
+    return np.allclose(kernel, get_bilinear_kernel(f_shape), rtol=0, atol=1e-6)
+
+def bilinear_upscore(x, new_shape, ksize, stride):
+    '''
+    Same result as conv2d_transpose(x, get_bilinear_kernel(...), new_shape, stride, 'SAME'),
+    computed per channel as two 1-D transposed convolutions (height, then width).
+    This costs about 2*ksize/stride MACs per output value and channel instead of
+    ksize*ksize*num_class/stride^2 for the dense diagonal kernel.
+    new_shape: [batch, height, width, channels] of the output
+    '''
+    in_shape = tf.shape(x)
+    channels = x.get_shape()[3].value
+    filt = get_bilinear_filter(ksize).astype(np.float32)
+    kernel_h = tf.constant(filt.reshape(ksize, 1, 1, 1))
+    kernel_w = tf.constant(filt.reshape(1, ksize, 1, 1))
+
+    # Move channels into the batch dimension: [B, H, W, C] -> [B*C, H, W, 1]
+    num = in_shape[0] * channels
+    x_c = tf.reshape(tf.transpose(x, [0, 3, 1, 2]), tf.pack([num, in_shape[1], in_shape[2], 1]))
+    up_h = tf.nn.conv2d_transpose(x_c, kernel_h, tf.pack([num, new_shape[1], in_shape[2], 1]),
+                                  strides=[1, stride, 1, 1], padding='SAME')
+    up = tf.nn.conv2d_transpose(up_h, kernel_w, tf.pack([num, new_shape[1], new_shape[2], 1]),
+                                strides=[1, 1, stride, 1], padding='SAME')
+    up = tf.reshape(up, tf.pack([in_shape[0], channels, new_shape[1], new_shape[2]]))
+    return tf.transpose(up, [0, 2, 3, 1])
+
+def get_deconv_kernel(feed_dict, feed_name, f_shape, defer_init=False):
     if not feed_dict.has_key(feed_name):
         print("No matched deconv_kernel %s, use bilinear interpolation " % feed_name)
-        # Bilinear interpolation
-        width = f_shape[0]
-        heigh = f_shape[0]
-        f = ceil(width/2.0)
-        c = (2 * f - 1 - f % 2) / (2.0 * f)
-        bilinear = np.zeros([f_shape[0], f_shape[1]])
-        for x in range(width):
-            for y in range(heigh):
-                value = (1 - abs(x / f - c)) * (1 - abs(y / f - c))
-                bilinear[x, y] = value
-        kernel = np.zeros(f_shape)
-        for i in range(f_shape[2]):
-            kernel[:, :, i, i] = bilinear
+        kernel = get_bilinear_kernel(f_shape)
     else:
         kernel = feed_dict[feed_name]
         print('Load deconv_kernel %s with shape: %s' % (feed_name, kernel.shape))
         
-    init = tf.constant_initializer(value=kernel, dtype=tf.float32)
+    init = pretrained_initializer(kernel, defer_init)
     var = tf.get_variable(name="upscore_kernel", initializer=init, shape=kernel.shape)
+    add_pretrained_weight(var, feed_name, None, default=lambda: get_bilinear_kernel(f_shape))
     return var
 
+def get_upsample_matrix(in_size, out_size, ksize, stride):
+    '''
+    [out_size, in_size] matrix of the 1-D bilinear transposed convolution that
+    upscore_layer() applies along one axis (conv2d_transpose, padding 'SAME'),
+    i.e. upsampled = U_h . scores . U_w^T for every class.
+    '''
+    filt = get_bilinear_filter(ksize).astype(np.float32)
+    pad_before = max((in_size - 1) * stride + ksize - out_size, 0) // 2
+    tap = np.arange(out_size)[:, np.newaxis] - np.arange(in_size)[np.newaxis, :] * stride + pad_before
+    valid = np.logical_and(tap >= 0, tap < ksize)
+    return np.where(valid, filt[np.clip(tap, 0, ksize - 1)], 0).astype(np.float32)
+
+def downsample_labels(labels, stride, size, num_classes=None, method='nearest'):
+    '''
+    Downsample a label map to the resolution of low resolution scores, used to compute
+    the loss at the output stride instead of on upsampled full resolution scores.
+    labels: int32 label map (trainIDs or instance ids), shape [batch, height, width, 1]
+    stride: output stride of the scores, e.g 8 for fuse_pool3
+    size: [height, width] of the scores, e.g tf.shape(scores)[1:3]
+    method: 'nearest' takes the top-left pixel of every stride x stride cell,
+            'majority' takes the most frequent label of the cell (needs num_classes,
+            labels >= num_classes e.g 255 are not counted)
+    Return: int32 label map, shape [batch, size[0], size[1]]
+    '''
+    if method == 'nearest':
+        down = tf.image.resize_nearest_neighbor(labels, size)
+    elif method == 'majority':
+        if num_classes is None:
+            raise ValueError('num_classes is needed for majority downsampling.')
+        one_hot = tf.one_hot(tf.squeeze(labels, squeeze_dims=[3]), num_classes, dtype=tf.float32)
+        # Padded pixels are not counted by avg_pool, so the cells at the border also work
+        votes = tf.nn.avg_pool(one_hot, ksize=[1, stride, stride, 1],
+                               strides=[1, stride, stride, 1], padding='SAME')
+        down = tf.expand_dims(tf.cast(tf.argmax(votes, dimension=3), tf.int32), 3)
+        down = tf.image.resize_nearest_neighbor(down, size)
+    else:
+        raise ValueError('Unknown label downsampling method %s' % method)
+    return tf.squeeze(down, squeeze_dims=[3])
+
+def loss_pixel_indices(labels, dilation=0, bg_rate=0.0):
+    '''
+    Select the pixels a loss is evaluated on: the foreground (label > 0) dilated by
+    `dilation` pixels, plus a random fraction bg_rate of the remaining background pixels.
+    labels: int32 label map, shape [batch, height, width]
+    Return: int32 indices into the flattened label map, use them with tf.gather on
+            labels reshaped to [-1] and scores reshaped to [-1, channels]
+    '''
+    fg = tf.expand_dims(tf.cast(tf.greater(labels, 0), tf.float32), 3)
+    if dilation > 0:
+        ksize = 2 * dilation + 1
+        fg = tf.nn.max_pool(fg, ksize=[1, ksize, ksize, 1], strides=[1, 1, 1, 1], padding='SAME')
+    selected = tf.greater(tf.reshape(fg, [-1]), 0)
+    if bg_rate > 0:
+        sampled = tf.less(tf.random_uniform(tf.shape(selected)), bg_rate)
+        selected = tf.logical_or(selected, sampled)
+    return tf.cast(tf.reshape(tf.where(selected), [-1]), tf.int32)
+
+def upsample_argmax(scores, out_height, out_width, ksize, stride, tile_rows=64, region=None):
+    '''
+    Argmax of the bilinearly upsampled scores without materializing the full resolution score stack.
+    scores: low resolution scores, shape [h, w, num_classes], e.g model['fuse_pool3'][0]
+    out_height, out_width, ksize, stride: as in the upscore_layer() that is replaced
+    tile_rows: number of output rows upsampled at once, bounds the memory to tile_rows x width x num_classes
+    region: optional (top, bottom, left, right) in output pixels, only this window is decoded
+    Return: int64 label map of shape [out_height, out_width] (or of the region)
+    '''
+    if region is None:
+        region = (0, out_height, 0, out_width)
+    (top, bottom, left, right) = region
+    scores = np.asarray(scores, dtype=np.float32)
+    U_h = get_upsample_matrix(scores.shape[0], out_height, ksize, stride)[top:bottom]
+    U_w = get_upsample_matrix(scores.shape[1], out_width, ksize, stride)[left:right]
+
+    # Only low resolution columns that contribute to the region
+    cols = np.nonzero(U_w.any(axis=0))[0]
+    (c0, c1) = (cols.min(), cols.max() + 1)
+    U_w = U_w[:, c0:c1]
+
+    labels = np.empty((bottom - top, right - left), dtype=np.int64)
+    for r0 in range(0, bottom - top, tile_rows):
+        r1 = min(r0 + tile_rows, bottom - top)
+        rows = np.nonzero(U_h[r0:r1].any(axis=0))[0]
+        (h0, h1) = (rows.min(), rows.max() + 1)
+        tile = np.einsum('th,hwc->twc', U_h[r0:r1, h0:h1], scores[h0:h1, c0:c1])
+        tile = np.einsum('twc,xw->txc', tile, U_w)
+        labels[r0:r1] = np.argmax(tile, axis=2)
+    return labels
+
+def deconv_argmax(scores, kernel, out_height, out_width, stride, region=None, channels=None):
+    '''
+    Argmax of conv2d_transpose(scores, kernel, strides=stride, padding='SAME') computed in numpy
+    for a window of the output only, with any (e.g learned) upscore kernel.
+    scores: low resolution scores, shape [h, w, in_channels]
+    kernel: upscore kernel, shape [ksize, ksize, out_channels, in_channels]
+    region: optional (top, bottom, left, right) in output pixels, only this window is decoded
+    channels: optional slice of the output channels the argmax is taken over
+    Return: int64 label map of shape [out_height, out_width] (or of the region)
+    '''
+    if region is None:
+        region = (0, out_height, 0, out_width)
+    (top, bottom, left, right) = region
+    scores = np.asarray(scores, dtype=np.float32)
+    kernel = np.asarray(kernel, dtype=np.float32)
+    if channels is not None:
+        kernel = kernel[:, :, channels]
+    ksize = kernel.shape[0]
+    (height, width) = scores.shape[:2]
+    pad_h = max((height - 1) * stride + ksize - out_height, 0) // 2
+    pad_w = max((width - 1) * stride + ksize - out_width, 0) // 2
+
+    # Input pixel i reaches the output rows i*stride - pad ... i*stride - pad + ksize - 1
+    i0 = max(-(-(top + pad_h - ksize + 1) // stride), 0)
+    i1 = min((bottom - 1 + pad_h) // stride + 1, height)
+    j0 = max(-(-(left + pad_w - ksize + 1) // stride), 0)
+    j1 = min((right - 1 + pad_w) // stride + 1, width)
+    x = scores[i0:i1, j0:j1]
+    (rows, cols) = ((i1 - i0 - 1) * stride + 1, (j1 - j0 - 1) * stride + 1)
+    out = np.zeros((rows + ksize - 1, cols + ksize - 1, kernel.shape[2]), dtype=np.float32)
+    for ty in range(ksize):
+        for tx in range(ksize):
+            out[ty:ty + rows:stride, tx:tx + cols:stride] += np.dot(x, kernel[ty, tx].T)
+    (y0, x0) = (top - (i0 * stride - pad_h), left - (j0 * stride - pad_w))
+    return np.argmax(out[y0:y0 + bottom - top, x0:x0 + right - left], axis=2)
+
+def roi_upsample_argmax(scores, mask, ksize, stride, pad=16, min_pixels=0, tile_rows=64, kernel=None, channels=None):
+    '''
+    upsample_argmax() restricted to padded bounding boxes of the connected regions of mask,
+    e.g the pixels predicted as car by the semantic network. Cost scales with the object area
+    instead of the frame size.
+    scores: low resolution scores, shape [h, w, channels], e.g score_out_mask[0]
+    mask: bool array [out_height, out_width], regions to decode
+    pad: pixels added around every bounding box
+    min_pixels: regions with fewer pixels are skipped
+    kernel: the upscore kernel [ksize, ksize, out_channels, in_channels] if it is not the bilinear one
+            (see is_fixed_bilinear()), e.g a trained 'upmask', the crops are then decoded with
+            deconv_argmax() instead of the separable bilinear upsampling
+    channels: optional slice of the (upsampled) channels the argmax is taken over, e.g one class
+              of the stacked instance masks
+    Return: int64 label map of shape [out_height, out_width], 0 outside the boxes
+    '''
+    if kernel is None and channels is not None:
+        # Bilinear upsampling keeps the channels apart
+        scores = scores[:, :, channels]
+    (out_height, out_width) = mask.shape
+    labels = np.zeros((out_height, out_width), dtype=np.int64)
+    (components, num) = ndimage.label(mask)
+    for (i, box) in enumerate(ndimage.find_objects(components)):
+        if min_pixels > 0 and np.count_nonzero(components[box] == i + 1) < min_pixels:
+            continue
+        top = max(box[0].start - pad, 0)
+        bottom = min(box[0].stop + pad, out_height)
+        left = max(box[1].start - pad, 0)
+        right = min(box[1].stop + pad, out_width)
+        if kernel is None:
+            labels[top:bottom, left:right] = upsample_argmax(scores, out_height, out_width, ksize, stride,
+                                                             tile_rows=tile_rows, region=(top, bottom, left, right))
+            continue
+        for r0 in range(top, bottom, tile_rows):
+            r1 = min(r0 + tile_rows, bottom)
+            labels[r0:r1, left:right] = deconv_argmax(scores, kernel, out_height, out_width, stride,
+                                                      region=(r0, r1, left, right), channels=channels)
+    return labels
+
 """
 def get_weight_variable_with_decay(name, shape, stddev = 0.1, wd = None):
     '''Helper to create an initialized Variable with weight decay.
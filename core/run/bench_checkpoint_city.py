@@ -0,0 +1,78 @@
+'''
+Peak memory vs. step time of full resolution fcn8s training with gradient checkpointing.
+Every setting of checkpoint_blocks (VGG16 blocks whose activations are recomputed in the
+backward pass, see FCN16VGG.train) runs a few training steps on training images in its own
+process, so the peak resident memory of the process only covers that setting.
+Run without arguments to benchmark all settings.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import resource
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+import data_utils as dt
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+train_data_config = {'city_dir':"../data/CityDatabase",
+                     'randomize': True,
+                     'seed': None,
+                     'dataset': 'train'}
+
+params = {'num_classes': 20, 'rate': 1e-6,
+          'trained_weight_path':'../data/val_weights/fcn16s/city_fcn16s_skip_100000.npy'}
+
+settings = [[], [1, 2], [1, 2, 3], [1, 2, 3, 4, 5]]
+warmup_iter = 2
+bench_iter = 10
+
+def bench(checkpoint_blocks):
+    '''Return: (seconds per step, peak resident memory in MB)'''
+    train_dataset = dt.CityDataSet(train_data_config)
+    with tf.Session() as sess:
+        fcn = FCN16VGG(params['trained_weight_path'], defer_init=True)
+        train_img = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+        train_label = tf.placeholder(tf.int32, shape=[None])
+        [train_op, loss] = fcn.train(params=params, image=train_img, truth=train_label, scale_min='fcn8s',
+                                     save_var=False, checkpoint_blocks=checkpoint_blocks)
+        sess.run(tf.initialize_all_variables())
+        fcn.init_weights(sess)
+        fcn.release_weights()
+
+        elapsed = 0.0
+        for i in range(warmup_iter + bench_iter):
+            next_pair = train_dataset.next_batch()
+            train_feed_dict = {train_img: next_pair[0],
+                               train_label: np.reshape(next_pair[1], -1)}
+            start = time.time()
+            sess.run(train_op, train_feed_dict)
+            if i >= warmup_iter:
+                elapsed += time.time() - start
+    # ru_maxrss is in KB on Linux
+    return (elapsed / bench_iter, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+if len(sys.argv) > 1:
+    blocks = [int(block) for block in sys.argv[1].split(',') if block]
+    print('RESULT %f %f' % bench(blocks))
+else:
+    results = []
+    for blocks in settings:
+        output = subprocess.check_output([sys.executable, __file__, ','.join(str(block) for block in blocks)])
+        line = [l for l in output.decode().splitlines() if l.startswith('RESULT')][-1]
+        (step_time, peak_mb) = [float(value) for value in line.split()[1:]]
+        results.append((blocks, step_time, peak_mb))
+
+    print('checkpoint_blocks     peak memory (MB)   step time (s)')
+    for (blocks, step_time, peak_mb) in results:
+        print('%-20s  %10.0f (%.2fx)   %8.3f (%.2fx)' % (str(blocks), peak_mb, peak_mb / results[0][2],
+                                                        step_time, step_time / results[0][1]))
@@ -0,0 +1,91 @@
+'''
+Compare full resolution inference (upscore8 + argmax in the graph) with the low resolution
+decode mode (fcn8s scores at 1/8 resolution, tiled bilinear upsampling fused with argmax
+in nn.upsample_argmax) on validation images.
+Reports mean IoU of both modes, their pixel agreement, the score buffer sizes and the latency.
+The decode is exact when upscore8 is still the bilinear kernel, otherwise the accuracy
+delta shows what is lost by replacing the learned upscore8 with bilinear upsampling.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG, LOWRES_SCORES
+import data_utils as dt
+import nn
+from eval.streamingConfusion import StreamingConfusionMatrix
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+val_data_config = {'city_dir':"../data/CityDatabase",
+                   'randomize': False,
+                   'seed': None,
+                   'dataset':'val'}
+
+params = {'num_classes': 20, 'ignore_labels': [19],
+          'scale': 'fcn8s',
+          'tile_rows': 64,
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy'}
+
+val_dataset = dt.CityDataSet(val_data_config)
+iterations = 100
+(score_name, ksize, stride) = LOWRES_SCORES[params['scale']]
+
+conf_full = StreamingConfusionMatrix(params['num_classes'], params['ignore_labels'])
+conf_low = StreamingConfusionMatrix(params['num_classes'], params['ignore_labels'])
+
+with tf.Session() as sess:
+    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    option = {'fcn32s':False, 'fcn16s':False, 'fcn8s':False}
+    option[params['scale']] = True
+    with tf.variable_scope('fullres'):
+        full_model = FCN16VGG(params['trained_weight_path'], defer_init=True)
+        predict_full = full_model.inference(image, params['num_classes'], scale_min=params['scale'],
+                                            option=option)[params['scale']]
+    with tf.variable_scope('lowres'):
+        low_model = FCN16VGG(params['trained_weight_path'], defer_init=True)
+        scores_low = low_model.inference_lowres(image, params['num_classes'], scale=params['scale'])
+
+    sess.run(tf.initialize_all_variables())
+    for model in [full_model, low_model]:
+        model.init_weights(sess)
+        model.release_weights()
+
+    time_full = 0.0
+    time_low = 0.0
+    agreement = 0.0
+    for i in range(iterations):
+        next_pair = val_dataset.next_batch()
+        feed_dict = {image: next_pair[0]}
+        (height, width) = next_pair[0].shape[1:3]
+
+        start = time.time()
+        pred_full = sess.run(predict_full, feed_dict=feed_dict)[0]
+        time_full += time.time() - start
+
+        start = time.time()
+        scores = sess.run(scores_low, feed_dict=feed_dict)[0]
+        pred_low = nn.upsample_argmax(scores, height, width, ksize, stride, tile_rows=params['tile_rows'])
+        time_low += time.time() - start
+
+        conf_full.add(pred_full, next_pair[1])
+        conf_low.add(pred_low, next_pair[1])
+        agreement += np.mean(pred_full == pred_low)
+
+full_bytes = height * width * params['num_classes'] * 4
+low_bytes = scores.nbytes + 2 * params['tile_rows'] * width * params['num_classes'] * 4
+print('Images: %d of size %dx%d, scale %s'%(iterations, height, width, params['scale']))
+print('                      full res     low res + tiled decode')
+print('mean IoU              %.4f       %.4f   (delta %+.4f)'%(conf_full.mean_iou(), conf_low.mean_iou(),
+                                                               conf_low.mean_iou() - conf_full.mean_iou()))
+print('score buffer (MB)     %.1f        %.1f'%(full_bytes / 2.0**20, low_bytes / 2.0**20))
+print('latency (s/image)     %.3f        %.3f'%(time_full / iterations, time_low / iterations))
+print('pixel agreement       %.5f'%(agreement / iterations))
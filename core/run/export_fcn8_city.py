@@ -0,0 +1,60 @@
+'''
+Export the fcn8s inference graph with frozen weights, then reload it with FrozenModel
+and compare its cold start time and its prediction with the python-built model.
+Serve from the exported file with:
+    model = FrozenModel('../data/frozen/city_fcn8s.pb', ['fcn8s'])
+    pred = model.run(image)['fcn8s']
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+from network.frozen_model import export_frozen_graph, FrozenModel, INPUT_NAME
+import data_utils as dt
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+val_data_config = {'city_dir':"../data/CityDatabase",
+                   'randomize': False,
+                   'seed': None,
+                   'dataset':'val'}
+
+params = {'num_classes': 20,
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'export_path':'../data/frozen/city_fcn8s.pb'}
+
+val_dataset = dt.CityDataSet(val_data_config)
+next_pair = val_dataset.next_batch()
+
+start = time.time()
+with tf.Graph().as_default(), tf.Session() as sess:
+    fcn = FCN16VGG(params['trained_weight_path'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=[None, None, None, 3], name=INPUT_NAME)
+    option = {'fcn32s':False, 'fcn16s':False, 'fcn8s':True}
+    predict_ = fcn.inference(image, num_classes=params['num_classes'], scale_min='fcn8s', option=option,
+                             separable_upscore=True)
+    sess.run(tf.initialize_all_variables())
+    fcn.init_weights(sess)
+    fcn.release_weights()
+    build_time = time.time() - start
+
+    pred_built = sess.run(predict_['fcn8s'], feed_dict={image: next_pair[0]})
+    export_frozen_graph(sess, {'fcn8s': predict_['fcn8s']}, params['export_path'])
+
+start = time.time()
+frozen = FrozenModel(params['export_path'], ['fcn8s'])
+load_time = time.time() - start
+pred_frozen = frozen.run(next_pair[0])['fcn8s']
+frozen.close()
+
+print('Cold start: built in python %.2f s, frozen graph %.2f s' % (build_time, load_time))
+print('Pixel agreement: %.5f' % np.mean(pred_built == pred_frozen))
@@ -0,0 +1,84 @@
+'''
+Low-rank factorization of conv6_3 and conv7 by truncated SVD.
+For every rank a factorized weight archive is written, which FCN16VGG builds from
+like any other weight file, and its latency and mean IoU on val images are compared
+with the original fcn8s weights.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+import data_utils as dt
+import compression
+from eval.streamingConfusion import StreamingConfusionMatrix
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+val_data_config = {'city_dir':"../data/CityDatabase",
+                   'randomize': False,
+                   'seed': None,
+                   'dataset':'val'}
+
+params = {'num_classes': 20, 'ignore_labels': [19],
+          'layers': ['conv6_3', 'conv7'],
+          'ranks': [1024, 512, 256, 128],
+          'energy': None,   # e.g 0.9 to choose the rank of every layer by the kept spectrum energy instead
+          'val_images': 100,
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'factorized_weight_path':'../data/val_weights/city_fcn8s_skip_100000_rank%s'}
+
+def evaluate(weight_path, val_dataset, num_images):
+    '''Return: (mean IoU, seconds per image)'''
+    conf = StreamingConfusionMatrix(params['num_classes'], params['ignore_labels'])
+    elapsed = 0.0
+    with tf.Graph().as_default(), tf.Session() as sess:
+        fcn = FCN16VGG(weight_path, defer_init=True)
+        image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+        option = {'fcn32s':False, 'fcn16s':False, 'fcn8s':True}
+        predict_ = fcn.inference(image, params['num_classes'], scale_min='fcn8s', option=option,
+                                 separable_upscore=True)['fcn8s']
+        sess.run(tf.initialize_all_variables())
+        fcn.init_weights(sess)
+        fcn.release_weights()
+        for img_id in range(num_images):
+            (ids, images, labels) = next(val_dataset.batch_generator(1, [img_id]))
+            start = time.time()
+            pred = sess.run(predict_, feed_dict={image: images})
+            # First run includes graph setup
+            if img_id > 0:
+                elapsed += time.time() - start
+            conf.add(pred, labels)
+    return (conf.mean_iou(), elapsed / max(num_images - 1, 1))
+
+val_dataset = dt.CityDataSet(val_data_config)
+num_images = min(params['val_images'], len(val_dataset.img_indices))
+data_dict = dt.load_weight(params['trained_weight_path'])
+base_macs = compression.conv_macs(data_dict, params['layers'])
+(base_miou, base_time) = evaluate(params['trained_weight_path'], val_dataset, num_images)
+
+results = []
+settings = params['ranks'] if params['energy'] is None else [None]
+for rank in settings:
+    (factorized, ranks) = compression.factorize_weights(data_dict, params['layers'], rank=rank, energy=params['energy'])
+    name = str(rank) if rank is not None else 'energy%g' % params['energy']
+    path = params['factorized_weight_path'] % name
+    dt.save_weight_archive(factorized, path)
+    macs = compression.conv_macs(factorized, params['layers'])
+    factorized = None
+    (miou, run_time) = evaluate(path, val_dataset, num_images)
+    results.append((ranks, macs, miou, run_time))
+
+print('Layers %s, %d val images' % (str(params['layers']), num_images))
+print('ranks                               MACs/pixel  speedup  mean IoU  delta')
+print('%-35s %10d  %6.2fx  %.4f' % ('original', base_macs, 1.0, base_miou))
+for (ranks, macs, miou, run_time) in results:
+    print('%-35s %10d  %6.2fx  %.4f  %+.4f' % (str(ranks), macs, base_time / run_time, miou, miou - base_miou))
@@ -0,0 +1,120 @@
+'''
+Iterative structured pruning of the VGG16 convs of fcn8s.
+Every cycle removes a fraction of the filters of each layer (lowest L1 norm, or lowest mean
+activation on calibration images), fine-tunes the slimmer network for a few iterations with
+FCN16VGG.train and saves the result as a regular weight file, so it can also be fine-tuned
+further with train_fcn32_city.py by pointing 'trained_weight_path' to it.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+import data_utils as dt
+import compression
+from eval.streamingConfusion import StreamingConfusionMatrix
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+train_data_config = {'city_dir':"../data/CityDatabase",
+                     'randomize': True,
+                     'seed': None,
+                     'dataset': 'train'}
+val_data_config = {'city_dir':"../data/CityDatabase",
+                   'randomize': False,
+                   'seed': None,
+                   'dataset':'val'}
+
+params = {'num_classes': 20, 'ignore_labels': [19], 'rate': 1e-6,
+          'criterion': 'l1',            # 'l1' or 'activation'
+          'calib_images': 8,
+          'cycle_ratio': 0.1,           # fraction of the remaining filters removed per cycle
+          'cycles': 3, 'finetune_iter': 5000,
+          'val_images': 100,
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'save_trained_weight_path':'../data/val_weights/city_fcn8s_pruned_%d.npy'}
+
+layers = sorted(compression.PRUNE_CONSUMERS.keys())
+
+def activation_scores(weight_path, dataset):
+    activations = dict((layer, []) for layer in layers)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        fcn = FCN16VGG(weight_path, defer_init=True)
+        image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+        activations_ = fcn.inference_activations(image, params['num_classes'], layers)
+        sess.run(tf.initialize_all_variables())
+        fcn.init_weights(sess)
+        fcn.release_weights()
+        for i in range(params['calib_images']):
+            values = sess.run(activations_, feed_dict={image: dataset.next_batch()[0]})
+            for layer in layers:
+                activations[layer].append(values[layer])
+    return dict((layer, compression.activation_filter_scores(activations[layer])) for layer in layers)
+
+def finetune(weight_path, dataset, save_path):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        fcn = FCN16VGG(weight_path, defer_init=True)
+        train_img = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+        train_label = tf.placeholder(tf.int32, shape=[None])
+        [train_op, loss] = fcn.train(params=params, image=train_img, truth=train_label, scale_min='fcn8s', save_var=True)
+        sess.run(tf.initialize_all_variables())
+        fcn.init_weights(sess)
+        fcn.release_weights()
+        for i in range(params['finetune_iter']):
+            next_pair = dataset.next_batch()
+            num_pixels = next_pair[0].shape[1] * next_pair[0].shape[2]
+            train_feed_dict = {train_img: next_pair[0],
+                               train_label: np.reshape(next_pair[1], num_pixels)}
+            sess.run(train_op, train_feed_dict)
+            if i % 100 == 0:
+                print('Iter %d Training Loss: %f' % (i, sess.run(loss, train_feed_dict)))
+        np.save(save_path, sess.run(fcn.var_dict))
+        print("trained weights saved: ", save_path)
+
+def evaluate(weight_path, dataset, num_images):
+    conf = StreamingConfusionMatrix(params['num_classes'], params['ignore_labels'])
+    with tf.Graph().as_default(), tf.Session() as sess:
+        fcn = FCN16VGG(weight_path, defer_init=True)
+        image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+        option = {'fcn32s':False, 'fcn16s':False, 'fcn8s':True}
+        predict_ = fcn.inference(image, params['num_classes'], scale_min='fcn8s', option=option)['fcn8s']
+        sess.run(tf.initialize_all_variables())
+        fcn.init_weights(sess)
+        fcn.release_weights()
+        for img_id in range(num_images):
+            (ids, images, labels) = next(dataset.batch_generator(1, [img_id]))
+            conf.add(sess.run(predict_, feed_dict={image: images}), labels)
+    return conf.mean_iou()
+
+train_dataset = dt.CityDataSet(train_data_config)
+val_dataset = dt.CityDataSet(val_data_config)
+num_images = min(params['val_images'], len(val_dataset.img_indices))
+
+weight_path = params['trained_weight_path']
+print('Cycle 0: mean IoU %.4f' % evaluate(weight_path, val_dataset, num_images))
+for cycle in range(1, params['cycles'] + 1):
+    scores = None
+    if params['criterion'] == 'activation':
+        scores = activation_scores(weight_path, train_dataset)
+    data_dict = dt.load_weight(weight_path)
+    ratios = dict((layer, params['cycle_ratio']) for layer in layers)
+    pruned = compression.prune_weights(data_dict, ratios, scores)
+    save_path = params['save_trained_weight_path'] % cycle
+    np.save(save_path, pruned)
+    widths = [np.shape(pruned[layer][0])[3] for layer in layers]
+    data_dict = None
+    pruned = None
+
+    miou_pruned = evaluate(save_path, val_dataset, num_images)
+    if params['finetune_iter'] > 0:
+        finetune(save_path, train_dataset, save_path)
+    weight_path = save_path
+    print('Cycle %d: widths %s, mean IoU %.4f after pruning, %.4f after fine-tuning' % (
+          cycle, str(dict(zip(layers, widths))), miou_pruned, evaluate(weight_path, val_dataset, num_images)))
@@ -0,0 +1,106 @@
+'''
+Post-training int8 quantization of fcn8s weights.
+- calibrate the per channel clipping of the given layers on crops of training images
+- save the quantized weights as a weight archive (int8 kernels, float bias and scales)
+- report the weight size and the mean IoU (eval/evalPixelSemantic) of the float and of the int8 model
+  on the val images
+The int8 archive is loaded like any other weight file: FCN16VGG(params['quantized_weight_path'])
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import random
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+import data_utils as dt
+import compression
+from eval import evalPixelSemantic
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+calib_data_config = {'city_dir':"../data/CityDatabase",
+                     'randomize': True,
+                     'seed': 0,
+                     'dataset':'train'}
+
+params = {'num_classes': 20,
+          'layers': ['conv6_3', 'conv7'],
+          'calib_images': 8, 'calib_crop': (512, 1024),
+          'pred_type_prefix': 'fcn8s_quantize_',
+          'val_save_path': '../data/quantize_city',
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'quantized_weight_path':'../data/val_weights/city_fcn8s_skip_100000_int8'}
+
+def evaluate(weight_path, name, batch_size=4):
+    '''
+    Save the trainID predictions of all val images under params['val_save_path']/<name>_trainIDs,
+    convert them to labelIDs and score them with evalPixelSemantic.
+    Return: mean IoU over the classes
+    '''
+    val_data_config = {'city_dir':"../data/CityDatabase",
+                       'randomize': False,
+                       'seed': None,
+                       'dataset':'val',
+                       'pred_save_path': os.path.join(params['val_save_path'], name + '_trainIDs'),
+                       'labelIDs_save_path': os.path.join(params['val_save_path'], name + '_labelIDs')}
+    for path in [val_data_config['pred_save_path'], val_data_config['labelIDs_save_path']]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    val_dataset = dt.CityDataSet(val_data_config)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        fcn = FCN16VGG(weight_path, defer_init=True)
+        image = tf.placeholder(tf.float32, shape=[None, None, None, 3])
+        option = {'fcn32s':False, 'fcn16s':False, 'fcn8s':True}
+        predict_ = fcn.inference(image, params['num_classes'], scale_min='fcn8s', option=option)['fcn8s']
+        sess.run(tf.initialize_all_variables())
+        fcn.init_weights(sess)
+        fcn.release_weights()
+        for (ids, images, labels) in val_dataset.batch_generator(batch_size):
+            predict = sess.run(predict_, feed_dict={image: images})
+            for (j, img_id) in enumerate(ids):
+                val_dataset.save_trainID_img(params['pred_type_prefix'], predict[j], img_idx=img_id)
+    val_dataset.pred_to_labelID([params['pred_type_prefix']])
+    return evalPixelSemantic.run_eval(val_data_config['labelIDs_save_path'])
+
+# Calibration activations
+calib_dataset = dt.CityDataSet(calib_data_config)
+input_names = [compression.LAYER_INPUTS[layer] for layer in params['layers']]
+calibration_inputs = dict((layer, []) for layer in params['layers'])
+with tf.Graph().as_default(), tf.Session() as sess:
+    fcn = FCN16VGG(params['trained_weight_path'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    activations_ = fcn.inference_activations(image, params['num_classes'], input_names)
+    sess.run(tf.initialize_all_variables())
+    fcn.init_weights(sess)
+    fcn.release_weights()
+    (crop_h, crop_w) = params['calib_crop']
+    for i in range(params['calib_images']):
+        next_pair = calib_dataset.next_batch()
+        top = random.randint(0, next_pair[0].shape[1] - crop_h)
+        left = random.randint(0, next_pair[0].shape[2] - crop_w)
+        crop = next_pair[0][:, top:top+crop_h, left:left+crop_w]
+        activations = sess.run(activations_, feed_dict={image: crop})
+        for layer in params['layers']:
+            calibration_inputs[layer].append(activations[compression.LAYER_INPUTS[layer]])
+
+# Quantize and save
+data_dict = dt.load_weight(params['trained_weight_path'])
+quantized = compression.quantize_weights(data_dict, params['layers'], calibration_inputs)
+dt.save_weight_archive(quantized, params['quantized_weight_path'])
+print('Weights: float %.1f MB, int8 %.1f MB' % (compression.weight_bytes(data_dict) / 2.0**20,
+                                                compression.weight_bytes(quantized) / 2.0**20))
+data_dict = None
+quantized = None
+
+# Mean IoU before and after, on all val images as evalPixelSemantic needs a prediction per ground truth
+miou_float = evaluate(params['trained_weight_path'], 'float')
+miou_int8 = evaluate(params['quantized_weight_path'], 'int8')
+print('Mean IoU on val: float %.4f, int8 %s %.4f (delta %+.4f)' % (miou_float, str(params['layers']),
+      miou_int8, miou_int8 - miou_float))
@@ -44,41 +44,43 @@ params = {'num_classes': 20, 'rate': 1e-4,
                                        # concatenated into the file name
 
 test_dataset = dt.CityDataSet(test_data_config)
-iterations = 1525
+# Images of the same size are run together in one sess.run
+batch_size = 4
 
 # For logging 
 print('Validation weight:%s \n'%params['trained_weight_path'])
 with tf.Session() as sess:
     # Init model and load approriate weights-data
-    vgg_fcn32s = FCN16VGG(params['trained_weight_path'])
-    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    vgg_fcn32s = FCN16VGG(params['trained_weight_path'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=[None, None, None, 3])
 
     # Build fcn32 model
     option={'fcn32s':False, 'fcn16s':False, 'fcn8s':True}
     predict_ = vgg_fcn32s.inference(image, num_classes=params['num_classes'],
-                                    scale_min='fcn8s', option=option)
+                                    scale_min='fcn8s', option=option, separable_upscore=True)
 
     predict = {}
     accuracy = 0.0
     print('Finished building inference network-fcn16.')
     init = tf.initialize_all_variables()
     sess.run(init)
+    vgg_fcn32s.init_weights(sess)
+    vgg_fcn32s.release_weights()
 
     print('Running the inference ...')
-    for i in range(iterations):
-        #print("iter:", i)
+    prefix_dict = []
+    for key in option.keys():
+        if option[key]:
+            prefix_dict.append(key+params['pred_type_prefix'])  # e.g fcn16_skip_ will be added into the name of pred_to_color
+    for (ids, images, labels) in test_dataset.batch_generator(batch_size):
         # Load data, Already converted to BGR
-        next_pair = test_dataset.next_batch()
-        next_pair_image = next_pair[0]
-        feed_dict = {image: next_pair_image}
+        feed_dict = {image: images}
 
         predict = sess.run(predict_, feed_dict=feed_dict)
-        prefix_dict = []
         for key in option.keys():
             if option[key]:
-                fname_prefix = key+params['pred_type_prefix']  # e.g fcn16_skip_ will be added into the name of pred_to_color
-                prefix_dict.append(fname_prefix)
-                test_dataset.save_trainID_img(fname_prefix, predict[key])
+                for (j, img_id) in enumerate(ids):
+                    test_dataset.save_trainID_img(key+params['pred_type_prefix'], predict[key][j], img_idx=img_id)
     # print("Inference done! Start transforming to colored ...")
     # test_dataset.pred_to_color()
     print("Inference done! Start transforming to labelIDs ...")
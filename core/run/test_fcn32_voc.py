@@ -42,15 +42,17 @@ params = {'num_classes': 22, 'rate': 1e-4,
 
 val_dataset = dt.VOCDataSet(train_data_config)
 iterations = 3
+# Images of the same size are run together in one sess.run
+batch_size = 4
 
 with tf.Session() as sess:
     # Init model and load approriate weights-data
     vgg_fcn32s = FCN16VGG(params['trained_weight_path'])
-    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    image = tf.placeholder(tf.float32, shape=[None, None, None, 3])
 
     # Build fcn32 model
     option={'fcn32s':True, 'fcn16s':False, 'fcn8s':False} 
-    predict_ = vgg_fcn32s.inference(image, num_classes=params['num_classes'], random_init_fc8=False, option=option)
+    predict_ = vgg_fcn32s.inference(image, num_classes=params['num_classes'], scale_min='fcn32s', option=option)
 
     predict = {}    
     print('Finished building inference network-fcn32.')
@@ -58,19 +60,15 @@ with tf.Session() as sess:
     sess.run(init)
 
     print('Running the inference ...')
-    for i in range(iterations):
-        print("iter:", i)
-        next_pair = val_dataset.next_batch()
-        idx = val_dataset.indices[val_dataset.idx]
-
-        next_pair_image = next_pair[0]
-        feed_dict = {image: next_pair_image}
+    for (ids, images, labels) in val_dataset.batch_generator(batch_size, val_dataset.indices[:iterations]):
+        print("batch:", ids)
+        feed_dict = {image: images}
 
         predict = sess.run(predict_, feed_dict=feed_dict)
         for key in option.keys():
             if option[key]:
-                pred_color = dt.color_image(predict[key][0], num_classes=params['num_classes'])
-                img_fpath = '../data/test_img/%s_%s_%s.png'%(train_data_config['classes'][0],key,idx)
-                scp.misc.imsave(img_fpath, pred_color)
-                print('Image saved: %s'%img_fpath)
-      
+                for (j, idx) in enumerate(ids):
+                    pred_color = dt.color_image(predict[key][j], num_classes=params['num_classes'])
+                    img_fpath = '../data/test_img/%s_%s_%s.png'%(train_data_config['classes'][0],key,idx)
+                    scp.misc.imsave(img_fpath, pred_color)
+                    print('Image saved: %s'%img_fpath)
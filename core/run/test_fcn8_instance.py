@@ -40,32 +40,33 @@ params = {'num_classes': 20, 'max_instance': 30,
 
 test_dataset = dt.CityDataSet(test_data_config)
 iterations = 2
+# Images of the same size are run together in one sess.run
+batch_size = 2
 
 
 with tf.Session() as sess:
     # Initialization
-    ifcn = InstanceFCN8s(data_path=params['trained_weight_path'], gt_class=params['gt_class'], pred_class=params['pred_class'])
-    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    ifcn = InstanceFCN8s(data_path=params['trained_weight_path'], gt_class=params['gt_class'], pred_class=params['pred_class'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=[None, None, None, 3])
 
-    # Build fcn8s_instance, return masks of each class [mask_11,mask_13]
-    # each mask has shape [1, h, w, 1]
-    predict, masks = ifcn.inference(params, image, direct_slice=False)
+    # Build fcn8s_instance, return masks of each class in pred_class
+    # each mask has shape [batch, h, w]
+    masks = ifcn.inference(params, image, direct_slice=False)
     print('Finished building inference network-fcn8s_instance.')
     init = tf.initialize_all_variables()
     sess.run(init)
+    ifcn.init_weights(sess)
+    ifcn.release_weights()
 
+    class_names = list(params['pred_class'].values())
     print('Running the inference ...')
-    for i in range(iterations):
+    for (ids, images, gt_masks) in test_dataset.batch_generator(batch_size, range(iterations)):
         # Load data, Already converted to BGR
-        next_pair = test_dataset.next_batch()
-        next_pair_image = next_pair[0]
-        feed_dict = {image: next_pair_image}
-        
-	np.save('./softmax/50000/inf.npy',sess.run(masks, feed_dict=feed_dict)) 
-        predict_ = sess.run(predict, feed_dict=feed_dict)
-        #imsave('../data/test_city_instance/person_%d.png'%i,predict_[0])
-        imsave('../data/test_city_instance/car_%d_color.png'%i, predict_[0])
-        #pname = '../data/test_city_instance/person_%d.png'%i
-        cname = '../data/test_city_instance/car_%d.png'%i
-        #toimage(predict_[0], high=params['max_instance'], low=0, cmin=0, cmax=params['max_instance']).save(pname)
-        toimage(predict_[0], high=params['max_instance'], low=0, cmin=0, cmax=params['max_instance']).save(cname)
+        feed_dict = {image: images}
+
+        predict_ = sess.run(masks, feed_dict=feed_dict)
+        for k in range(len(predict_)):
+            for (j, img_id) in enumerate(ids):
+                imsave('../data/test_city_instance/%s_%d_color.png'%(class_names[k], img_id), predict_[k][j])
+                cname = '../data/test_city_instance/%s_%d.png'%(class_names[k], img_id)
+                toimage(predict_[k][j], high=params['max_instance'], low=0, cmin=0, cmax=params['max_instance']).save(cname)
@@ -0,0 +1,65 @@
+'''
+Testing script for joint semantic + instance inference with a shared VGG16 trunk.
+One sess.run per image returns the fcn8s semantic prediction and the instance masks.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_joint import JointFCN8s
+import data_utils as dt
+
+from scipy.misc import toimage
+
+# Specify which GPU to use
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+test_data_config = {'city_dir':"../data/CityDatabase",
+                    'randomize': False,
+                    'seed': None,
+                    'dataset':'val',
+                    'pred_save_path':'../data/test_city_trainIDs'}
+
+params = {'num_classes': 20, 'max_instance': 30,
+          'pred_class':{13:'car'},
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'instance_weight_path':'../data/val_weights/city_instance_50000.npy',
+          'pred_type_prefix':'fcn8s_joint_',
+          'instance_save_path':'../data/test_city_instance'}
+
+test_dataset = dt.CityDataSet(test_data_config)
+iterations = len(test_dataset.img_indices)
+
+with tf.Session() as sess:
+    jfcn = JointFCN8s(data_path=params['trained_weight_path'],
+                      instance_data_path=params['instance_weight_path'],
+                      pred_class=params['pred_class'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+
+    semantic_, masks_ = jfcn.inference(params, image)
+    print('Finished building joint inference network.')
+    init = tf.initialize_all_variables()
+    sess.run(init)
+    jfcn.init_weights(sess)
+    jfcn.release_weights()
+
+    class_names = list(params['pred_class'].values())
+    print('Running the inference ...')
+    for i in range(iterations):
+        next_pair = test_dataset.next_batch()
+        feed_dict = {image: next_pair[0]}
+
+        # Trunk is computed once for both outputs
+        semantic, masks = sess.run([semantic_, masks_], feed_dict=feed_dict)
+        test_dataset.save_trainID_img(params['pred_type_prefix'], semantic)
+        for k in range(len(masks)):
+            mname = os.path.join(params['instance_save_path'], '%s_%d.png'%(class_names[k], i))
+            toimage(masks[k][0], high=params['max_instance'], low=0, cmin=0, cmax=params['max_instance']).save(mname)
+    print('Inference done!')
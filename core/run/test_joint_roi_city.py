@@ -0,0 +1,82 @@
+'''
+Testing script for joint inference with ROI-cropped instance decoding.
+The instance head stops at stride 8, its masks are upsampled and argmaxed only inside
+padded bounding boxes of the regions the semantic prediction labels as one of pred_class,
+with the trained upmask kernel (or the separable bilinear upsampling while it is bilinear),
+so the decode time depends on the number and size of the objects, not on the frame size.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_joint import JointFCN8s
+import data_utils as dt
+import nn
+
+from scipy.misc import toimage
+
+# Specify which GPU to use
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+test_data_config = {'city_dir':"../data/CityDatabase",
+                    'randomize': False,
+                    'seed': None,
+                    'dataset':'val',
+                    'pred_save_path':'../data/test_city_trainIDs'}
+
+params = {'num_classes': 20, 'max_instance': 30,
+          'pred_class':{13:'car'},
+          'roi_pad': 16, 'roi_min_pixels': 64,
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'instance_weight_path':'../data/val_weights/city_instance_50000.npy',
+          'pred_type_prefix':'fcn8s_joint_',
+          'instance_save_path':'../data/test_city_instance'}
+
+test_dataset = dt.CityDataSet(test_data_config)
+iterations = len(test_dataset.img_indices)
+
+with tf.Session() as sess:
+    jfcn = JointFCN8s(data_path=params['trained_weight_path'],
+                      instance_data_path=params['instance_weight_path'],
+                      pred_class=params['pred_class'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+
+    semantic_, scores_, upmask_kernel, channels = jfcn.inference_roi(params, image)
+    print('Finished building joint inference network.')
+    init = tf.initialize_all_variables()
+    sess.run(init)
+    jfcn.init_weights(sess)
+    jfcn.release_weights()
+
+    class_ids = list(params['pred_class'].keys())
+    class_names = list(params['pred_class'].values())
+    decode_time = 0.0
+    print('Running the inference ...')
+    for i in range(iterations):
+        next_pair = test_dataset.next_batch()
+        feed_dict = {image: next_pair[0]}
+
+        semantic, scores = sess.run([semantic_, scores_], feed_dict=feed_dict)
+        test_dataset.save_trainID_img(params['pred_type_prefix'], semantic)
+
+        start = time.time()
+        masks = []
+        for k in range(len(channels)):
+            masks.append(nn.roi_upsample_argmax(scores[0], semantic[0] == class_ids[k], ksize=16, stride=8,
+                                                pad=params['roi_pad'], min_pixels=params['roi_min_pixels'],
+                                                kernel=upmask_kernel, channels=channels[k]))
+        decode_time += time.time() - start
+
+        for k in range(len(masks)):
+            mname = os.path.join(params['instance_save_path'], '%s_%d.png'%(class_names[k], i))
+            toimage(masks[k], high=params['max_instance'], low=0, cmin=0, cmax=params['max_instance']).save(mname)
+    print('Instance decode: %.3f s/image' % (decode_time / iterations))
+    print('Inference done!')
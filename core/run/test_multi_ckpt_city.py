@@ -0,0 +1,115 @@
+'''
+Evaluate several checkpoints of fcn8s in a single pass over the validation dataset.
+Every image is decoded once and fed to all checkpoints, each checkpoint keeps its own
+streaming confusion matrix, so a sweep over K snapshots costs one decode pass instead of K.
+
+Two modes:
+ - 'towers': one inference tower per checkpoint in the same graph, all run by one sess.run.
+             Needs the memory of K models.
+ - 'swap':   a single tower, chunk_size images are decoded and kept in memory, then every
+             checkpoint is loaded once with load_weights() and run on the whole chunk.
+             Needs the memory of one model and one weight dict at a time, use weight archives
+             (dt.weight_archive_transform) so that the switches are read from memory-mapped files.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+import data_utils as dt
+from eval.streamingConfusion import StreamingConfusionMatrix
+
+# Specify which GPU to use
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+# Validation dataset, labels are trainIds
+val_data_config = {'city_dir':"../data/CityDatabase",
+                   'randomize': False,
+                   'seed': None,
+                   'dataset':'val'}
+
+params = {'num_classes': 20, 'ignore_labels': [19],
+          'scale': 'fcn8s',
+          'mode': 'towers',
+          'chunk_size': 20,      # images decoded at once (~26MB each), every checkpoint is swapped in once per chunk
+          'trained_weight_paths':['../data/val_weights/city_fcn8s_skip_50000.npy',
+                                  '../data/val_weights/city_fcn8s_skip_100000.npy'],
+          'result_path': '../data/val_weights/multi_ckpt_confusion.npz'}
+
+val_dataset = dt.CityDataSet(val_data_config)
+iterations = len(val_dataset.img_indices)
+ckpt_paths = params['trained_weight_paths']
+option = {'fcn32s':False, 'fcn16s':False, 'fcn8s':False}
+option[params['scale']] = True
+
+class_names = [label.name for label in val_dataset.labels]
+confusions = [StreamingConfusionMatrix(params['num_classes'], params['ignore_labels'], class_names)
+              for path in ckpt_paths]
+
+print('Evaluating %d checkpoints in %s mode'%(len(ckpt_paths), params['mode']))
+with tf.Session() as sess:
+    image = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    models = []
+    predicts = []
+    if params['mode'] == 'towers':
+        for k in range(len(ckpt_paths)):
+            with tf.variable_scope('ckpt_%d'%k):
+                model = FCN16VGG(ckpt_paths[k], defer_init=True)
+                predict = model.inference(image, num_classes=params['num_classes'],
+                                          scale_min=params['scale'], option=option)
+            models.append(model)
+            predicts.append(predict[params['scale']])
+    else:
+        model = FCN16VGG(ckpt_paths[0], defer_init=True)
+        predict = model.inference(image, num_classes=params['num_classes'],
+                                  scale_min=params['scale'], option=option)
+        models.append(model)
+        predicts.append(predict[params['scale']])
+
+    print('Finished building inference network.')
+    init = tf.initialize_all_variables()
+    sess.run(init)
+    for model in models:
+        model.init_weights(sess)
+        model.release_weights()
+
+    print('Running the inference ...')
+    # Index of the checkpoint currently in the swap tower, init_weights() loaded the first one
+    loaded = 0
+    for start in range(0, iterations, params['chunk_size']):
+        # Decode once for all checkpoints
+        chunk = [val_dataset.next_batch() for i in range(min(params['chunk_size'], iterations - start))]
+
+        if params['mode'] == 'towers':
+            for (img, truth) in chunk:
+                predictions = sess.run(predicts, feed_dict={image: img})
+                for k in range(len(ckpt_paths)):
+                    confusions[k].add(predictions[k], truth)
+        else:
+            # Start with the checkpoint already loaded, alternating the order between chunks
+            order = list(range(len(ckpt_paths)))
+            if loaded != 0:
+                order.reverse()
+            for k in order:
+                if k != loaded:
+                    # Loaded lazily from the path, only one weight dict is resident
+                    models[0].load_weights(sess, ckpt_paths[k])
+                    loaded = k
+                for (img, truth) in chunk:
+                    confusions[k].add(sess.run(predicts[0], feed_dict={image: img}), truth)
+        print('Images processed: %d'%(start + len(chunk)))
+
+print('Evaluation done!')
+for k in range(len(ckpt_paths)):
+    print(confusions[k].summary(os.path.basename(ckpt_paths[k])))
+np.savez(params['result_path'],
+         trained_weight_paths=np.array(ckpt_paths),
+         confusion=np.array([conf.matrix for conf in confusions]))
+print('Confusion matrices saved to %s'%params['result_path'])
@@ -0,0 +1,66 @@
+'''
+Testing script for tiled sliding-window inference of fcn8s.
+The model is built on fixed size tiles, so the memory does not grow with the input
+resolution. Reports the mean IoU on the validation set and the time per image.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+from network.tiled_inference import TiledInference
+import data_utils as dt
+from eval.streamingConfusion import StreamingConfusionMatrix
+
+# Specify which GPU to use
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+val_data_config = {'city_dir':"../data/CityDatabase",
+                   'randomize': False,
+                   'seed': None,
+                   'dataset':'val',
+                   'pred_save_path':'../data/test_city_trainIDs'}
+
+params = {'num_classes': 20, 'ignore_labels': [19],
+          'scale': 'fcn8s',
+          'tile_size': (512, 512), 'overlap': 64, 'batch_size': 4,
+          'trained_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'pred_type_prefix':'fcn8s_tiled_'}
+
+val_dataset = dt.CityDataSet(val_data_config)
+iterations = len(val_dataset.img_indices)
+conf = StreamingConfusionMatrix(params['num_classes'], params['ignore_labels'])
+
+with tf.Session() as sess:
+    fcn = FCN16VGG(params['trained_weight_path'], defer_init=True)
+    (tile_h, tile_w) = params['tile_size']
+    image = tf.placeholder(tf.float32, shape=[None, tile_h, tile_w, 3])
+    scores = fcn.inference_scores(image, params['num_classes'], scale=params['scale'], separable_upscore=True)
+
+    sess.run(tf.initialize_all_variables())
+    fcn.init_weights(sess)
+    fcn.release_weights()
+
+    tiled = TiledInference(sess, image, scores, tile_size=params['tile_size'],
+                           overlap=params['overlap'], batch_size=params['batch_size'])
+    total_time = 0.0
+    print('Running the tiled inference ...')
+    for i in range(iterations):
+        next_pair = val_dataset.next_batch()
+        start = time.time()
+        pred = tiled.predict(next_pair[0])
+        total_time += time.time() - start
+
+        conf.add(pred, next_pair[1])
+        val_dataset.save_trainID_img(params['pred_type_prefix'], pred[np.newaxis])
+    print('Tiles %s, overlap %d, batch %d: %.3f s/image' % (str(params['tile_size']), params['overlap'],
+                                                           params['batch_size'], total_time / iterations))
+    print(conf.summary('Tiled %s' % params['scale']))
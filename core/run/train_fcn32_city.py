@@ -46,12 +46,17 @@ train_dataset = dt.CityDataSet(train_data_config)
 # Hyper-parameters
 train_iter = 50000
 val_step = 10000
+# Compute the loss at the output stride of fcn_scale against downsampled labels,
+# skips the final upscore layer. Use False for a full resolution fine-tune stage.
+lowres_loss = False
+# Average the gradients of accum_steps images per update, iterations count images
+accum_steps = 1
 
 # Logging config
 print('Training config: fcn_scale %s, iters %d'%(fcn_scale, train_iter))
 with tf.Session() as sess:
     # Init CNN -> load pre-trained weights from VGG16.
-    fcn = FCN16VGG(params['trained_weight_path'])
+    fcn = FCN16VGG(params['trained_weight_path'], defer_init=True)
     npy_path = params['save_trained_weight_path']
     
     # Be aware of loaded data type....
@@ -59,7 +64,8 @@ with tf.Session() as sess:
     train_label = tf.placeholder(tf.int32, shape=[None])
     
     # create model and train op
-    [train_op, loss] = fcn.train(params=params, image=train_img, truth=train_label, scale_min=fcn_scale, save_var=True)
+    [train_op, loss] = fcn.train(params=params, image=train_img, truth=train_label, scale_min=fcn_scale, save_var=True,
+                                  lowres_loss=lowres_loss, accum_steps=accum_steps)
     var_dict_to_train = fcn.var_dict
     tf.scalar_summary('train_loss', loss)
     
@@ -68,6 +74,12 @@ with tf.Session() as sess:
     
     init = tf.initialize_all_variables()
     sess.run(init)
+    fcn.init_weights(sess)
+    fcn.release_weights()
+
+    # Writes <prefix>_<iter>.npy as before. For per-layer archives that only store the changed
+    # layers use archive=True, delta=True, and keep=3 to remove older snapshots.
+    ckpt_writer = dt.CheckpointWriter(npy_path, prefix='city_%s_skip'%fcn_scale, archive=False, delta=False, keep=None)
 
     print('Start training...')
     for i in range(train_iter+1):
@@ -82,24 +94,21 @@ with tf.Session() as sess:
 
         train_feed_dict = {train_img: next_pair_image,
                            train_label: next_pair_label,}
-        sess.run(train_op, train_feed_dict) 
+        if accum_steps > 1:
+            train_op.step(sess, train_feed_dict)
+        else:
+            sess.run(train_op, train_feed_dict) 
         # Save loss value
         if i % 100 == 0:
             summary, loss_value = sess.run([merged_summary, loss], train_feed_dict)
             writer.add_summary(summary, i)
             print('Iter %d Training Loss: %f' % (i,loss_value))
             
-        # Save weight for validation
+        # Save weight for validation, written to disk in the background
         if i >= val_step and i % val_step == 0:
-            train_weight_dict = sess.run(var_dict_to_train)
             print('Saving trained weight after %d iterations... '%i)
-            if len(train_weight_dict.keys()) != 0:
-                #for key in train_weight_dict.keys():
-                #    print('Layer: %s  Weight shape: %s   Bias shape: %s'%(key, train_weight_dict[key][0].shape, train_weight_dict[key][1].shape))
-                fname = 'city_%s_skip_%d.npy'%(fcn_scale,i)
-		fpath = npy_path+fname
-                np.save(fpath, train_weight_dict)
-                print("trained weights saved: ", fpath)
+            ckpt_writer.save(i, sess.run(var_dict_to_train))
+    ckpt_writer.close()
     print('Finished training')
 
     
@@ -41,18 +41,28 @@ params = {'rate': 1e-4, 'num_classes': 20, 'max_instance': 30,
 train_dataset = dt.CityDataSet(train_data_config)
 train_iter = 80000
 val_step = 5000
+# Compute the loss on the stride 8 scores against downsampled masks, skips the upmask upsampling
+lowres_loss = False
+# Only compute the loss around the instances and on 5% of the background pixels
+fg_loss = False
+# Average the gradients of accum_steps images per update, iterations count images
+accum_steps = 1
+# Freeze the trunk and only train the instance head, needed to use the weights with JointFCN8s
+head_only = False
 
 # Logging config
 print('Training config: iters %d'%train_iter)
 with tf.Session() as sess:
     # Initialization
-    ifcn = InstanceFCN8s(data_path=params['trained_weight_path'], gt_class=params['gt_class'], pred_class=params['pred_class'])
+    ifcn = InstanceFCN8s(data_path=params['trained_weight_path'], gt_class=params['gt_class'], pred_class=params['pred_class'], defer_init=True)
     npy_path = params['save_trained_weight_path']
     train_img = tf.placeholder(tf.float32, shape=[1, None, None, 3])
     train_gt_mask = tf.placeholder(tf.int32, shape=[1, None, None, len(params['gt_class'])])
     
     # create model and train op    
-    train_op, loss = ifcn.train(params=params, image=train_img, gt_masks=train_gt_mask, direct_slice=False, save_var=True)
+    train_op, loss = ifcn.train(params=params, image=train_img, gt_masks=train_gt_mask, direct_slice=False, save_var=True,
+                                lowres_loss=lowres_loss, fg_loss=fg_loss, accum_steps=accum_steps,
+                                head_only=head_only)
     var_dict_to_train = ifcn.var_dict
     tf.scalar_summary('train_loss', loss)
     
@@ -61,6 +71,12 @@ with tf.Session() as sess:
     
     init = tf.initialize_all_variables()
     sess.run(init)
+    ifcn.init_weights(sess)
+    ifcn.release_weights()
+
+    # Writes <prefix>_<iter>.npy as before. For per-layer archives that only store the changed
+    # layers use archive=True, delta=True, and keep=3 to remove older snapshots.
+    ckpt_writer = dt.CheckpointWriter(npy_path, prefix='city_instance', archive=False, delta=False, keep=None)
 
     print('Start training...')
     for i in range(train_iter+1):
@@ -72,7 +88,10 @@ with tf.Session() as sess:
         train_feed_dict = {train_img: next_pair_image,
                            train_gt_mask: next_pair_gt_mask,}
         
-        sess.run(train_op, train_feed_dict)
+        if accum_steps > 1:
+            train_op.step(sess, train_feed_dict)
+        else:
+            sess.run(train_op, train_feed_dict)
         #loss_value = sess.run(loss, train_feed_dict)
         #print('Iter %d Training Loss: %f' % (i,loss_value))
         
@@ -83,18 +102,11 @@ with tf.Session() as sess:
             writer.add_summary(summary, i)
             print('Iter %d Training Loss: %f' % (i,loss_value))
             
-        # Save weight for validation
+        # Save weight for validation, written to disk in the background
         if i >= val_step and i % val_step == 0:
-            train_weight_dict = sess.run(var_dict_to_train)
             print('Saving trained weight after %d iterations... '%i)
-            if len(train_weight_dict.keys()) != 0:
-                for key in train_weight_dict.keys():
-                    print('Layer: %s  Weight shape: %s   Bias shape: %s'%(key, train_weight_dict[key][0].shape, train_weight_dict[key][1].shape))
-                fname = 'city_instance_%d.npy'%i
-		fpath = npy_path+fname
-                np.save(fpath, train_weight_dict)
-                print("trained weights saved: ", fpath)
-       
+            ckpt_writer.save(i, sess.run(var_dict_to_train))
+    ckpt_writer.close()
     print('Finished training')
 
     
@@ -0,0 +1,104 @@
+'''
+Head-only training of the fcn skip head on cached trunk features.
+1. The frozen VGG16 trunk (conv1_1 ... conv7) is run once per training image and its
+   pool3, pool4 and conv7 outputs are stored in a memory-mapped FeatureCache (float16).
+   Images already in the cache are skipped, so an interrupted run resumes.
+2. The head (score_fr, score_pool4, score_pool3 and the upscore layers) is trained from
+   the cache, every step only reads the features and runs the head.
+The saved weights are the trunk weights of trained_weight_path with the trained head
+merged in, so they load like any other fcn checkpoint.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import random
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+import data_utils as dt
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+train_data_config = {'city_dir':"../data/CityDatabase",
+                     'randomize': False,
+                     'seed': None,
+                     'dataset': 'train'}
+
+fcn_scale = 'fcn8s'
+params = {'num_classes': 20, 'rate': 1e-6,
+          'features': ['pool3', 'pool4', 'conv7'],
+          'image_shape': [1, 1024, 2048, 3],
+          'cache_dtype': np.float16,
+          'feature_cache_path':'../data/feature_cache/city_train',
+          'tsboard_save_path': '../data/tsboard_result/head_%s'%fcn_scale,
+          'trained_weight_path':'../data/val_weights/fcn16s/city_fcn16s_skip_100000.npy',
+          'save_trained_weight_path':'../data/val_weights/'}
+
+train_dataset = dt.CityDataSet(train_data_config)
+num_images = len(train_dataset.img_indices)
+train_iter = 50000
+val_step = 10000
+
+# Step 1: fill the feature cache
+with tf.Graph().as_default(), tf.Session() as sess:
+    trunk = FCN16VGG(params['trained_weight_path'], defer_init=True)
+    image = tf.placeholder(tf.float32, shape=params['image_shape'])
+    features_ = trunk.inference_activations(image, params['num_classes'], params['features'])
+    shapes = dict((name, features_[name].get_shape().as_list()[1:]) for name in params['features'])
+    cache = dt.FeatureCache(params['feature_cache_path'], shapes, num_images, dtype=params['cache_dtype'])
+
+    missing = [img_id for img_id in range(num_images) if not cache.has(img_id)]
+    if missing:
+        sess.run(tf.initialize_all_variables())
+        trunk.init_weights(sess)
+    trunk.release_weights()
+    print('Caching trunk features of %d images ...' % len(missing))
+    for (ids, images, labels) in train_dataset.batch_generator(1, missing):
+        cache.put(ids[0], sess.run(features_, feed_dict={image: images}))
+        if ids[0] % 100 == 0:
+            cache.flush()
+    cache.flush()
+
+# Step 2: train the head from the cache
+with tf.Graph().as_default(), tf.Session() as sess:
+    fcn = FCN16VGG(params['trained_weight_path'], defer_init=True)
+    features = dict((name, tf.placeholder(tf.float32, shape=[1] + cache.shape(name))) for name in params['features'])
+    train_label = tf.placeholder(tf.int32, shape=[None])
+    [train_op, loss] = fcn.train_head(params, features, tf.constant(params['image_shape']), train_label,
+                                      scale_min=fcn_scale, save_var=True)
+    tf.scalar_summary('train_loss', loss)
+    merged_summary = tf.merge_all_summaries()
+    writer = tf.train.SummaryWriter(params['tsboard_save_path'], sess.graph)
+
+    sess.run(tf.initialize_all_variables())
+    fcn.init_weights(sess)
+    fcn.release_weights()
+
+    print('Start training...')
+    for i in range(train_iter+1):
+        img_id = random.randint(0, num_images-1)
+        label = train_dataset.load_label(train_dataset.lbl_indices[img_id])
+        train_feed_dict = {train_label: np.reshape(label, -1)}
+        cached = cache.get(img_id)
+        for name in params['features']:
+            train_feed_dict[features[name]] = cached[name]
+        sess.run(train_op, train_feed_dict)
+        if i % 100 == 0:
+            summary, loss_value = sess.run([merged_summary, loss], train_feed_dict)
+            writer.add_summary(summary, i)
+            print('Iter %d Training Loss: %f' % (i, loss_value))
+
+        if i >= val_step and i % val_step == 0:
+            trunk_dict = dt.load_weight(params['trained_weight_path'])
+            weight_dict = dict((key, trunk_dict[key]) for key in trunk_dict.keys())
+            weight_dict.update(sess.run(fcn.var_dict))
+            fpath = params['save_trained_weight_path'] + 'city_%s_head_%d.npy' % (fcn_scale, i)
+            np.save(fpath, weight_dict)
+            print("trained weights saved: ", fpath)
+    print('Finished training')
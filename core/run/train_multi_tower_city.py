@@ -0,0 +1,98 @@
+'''
+Synchronous data-parallel training on one machine: num_towers replicas of FCN16VGG
+(or InstanceFCN8s) on the local CPU devices, each fed from its own shard of the Cityscapes
+training set. The gradients of the towers are averaged before the Adam update, so
+an iteration trains on num_towers images. Weights are saved like train_fcn32_city.py.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+from network.fcn_instance import InstanceFCN8s
+from network import multi_tower
+import data_utils as dt
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+model_type = 'fcn'     # 'fcn' or 'instance'
+num_towers = 4
+# Intra-op threads per tower, e.g number of cores / num_towers
+threads_per_tower = 16
+
+fcn_scale = 'fcn8s'
+params = {'num_classes': 20, 'rate': 1e-6, 'max_instance': 30,
+          'gt_class':{11:'person', 13:'car'},
+          'pred_class':{13:'car'},
+          'tsboard_save_path': '../data/tsboard_result/multi_tower_%s'%model_type,
+          'trained_weight_path':'../data/val_weights/fcn16s/city_fcn16s_skip_100000.npy',
+          'save_trained_weight_path':'../data/val_weights/'}
+
+train_datasets = []
+for i in range(num_towers):
+    train_data_config = {'city_dir':"../data/CityDatabase",
+                         'randomize': True,
+                         'use_gt_mask': model_type == 'instance',
+                         'seed': i,
+                         'dataset': 'train',
+                         'num_shards': num_towers,
+                         'shard': i}
+    train_datasets.append(dt.CityDataSet(train_data_config))
+
+train_iter = 50000
+val_step = 10000
+
+print('Training config: %s, %d towers, iters %d'%(model_type, num_towers, train_iter))
+with tf.Session(config=multi_tower.session_config(num_towers, threads_per_tower)) as sess:
+    train_img = [tf.placeholder(tf.float32, shape=[1, None, None, 3]) for i in range(num_towers)]
+    if model_type == 'instance':
+        model = InstanceFCN8s(data_path=params['trained_weight_path'], gt_class=params['gt_class'],
+                              pred_class=params['pred_class'], defer_init=True)
+        train_truth = [tf.placeholder(tf.int32, shape=[1, None, None, len(params['gt_class'])]) for i in range(num_towers)]
+        tower_fn = lambda i: model.gradients(params, train_img[i], train_truth[i], optimizer, direct_slice=False,
+                                             save_var=(i == 0))
+    else:
+        model = FCN16VGG(params['trained_weight_path'], defer_init=True)
+        train_truth = [tf.placeholder(tf.int32, shape=[None]) for i in range(num_towers)]
+        tower_fn = lambda i: model.gradients(params, train_img[i], train_truth[i], optimizer, scale_min=fcn_scale,
+                                             save_var=(i == 0))
+
+    optimizer = tf.train.AdamOptimizer(params['rate'])
+    (grads_and_vars, loss) = multi_tower.build_towers(tower_fn, multi_tower.cpu_devices(num_towers))
+    train_op = optimizer.apply_gradients(grads_and_vars)
+    tf.scalar_summary('train_loss', loss)
+    merged_summary = tf.merge_all_summaries()
+    writer = tf.train.SummaryWriter(params['tsboard_save_path'], sess.graph)
+
+    sess.run(tf.initialize_all_variables())
+    model.init_weights(sess)
+    model.release_weights()
+
+    print('Start training...')
+    for i in range(train_iter+1):
+        train_feed_dict = {}
+        for (tower, dataset) in enumerate(train_datasets):
+            next_pair = dataset.next_batch()
+            train_feed_dict[train_img[tower]] = next_pair[0]
+            if model_type == 'instance':
+                train_feed_dict[train_truth[tower]] = next_pair[1]
+            else:
+                train_feed_dict[train_truth[tower]] = np.reshape(next_pair[1], -1)
+        sess.run(train_op, train_feed_dict)
+        if i % 100 == 0:
+            summary, loss_value = sess.run([merged_summary, loss], train_feed_dict)
+            writer.add_summary(summary, i)
+            print('Iter %d Training Loss: %f' % (i, loss_value))
+
+        if i >= val_step and i % val_step == 0:
+            fpath = params['save_trained_weight_path'] + 'city_%s_%d_towers_%d.npy' % (model_type, num_towers, i)
+            np.save(fpath, sess.run(model.var_dict))
+            print("trained weights saved: ", fpath)
+    print('Finished training')
@@ -0,0 +1,95 @@
+'''
+Training with the in-graph input pipeline of dataset.input_queue: queue runner threads
+read and decode the next Cityscapes images while the current step runs, the model is built
+directly on the dequeued tensors and no feed_dict is used.
+Same models, hyper-parameters and weight saving as train_fcn32_city.py ('fcn') and
+train_fcn8_instance.py ('instance').
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+from network.fcn_instance import InstanceFCN8s
+from dataset.input_queue import input_queue
+import data_utils as dt
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+model_type = 'fcn'     # 'fcn' or 'instance'
+train_data_config = {'city_dir':"../data/CityDatabase",
+                     'randomize': False,
+                     'use_gt_mask': model_type == 'instance',
+                     'seed': None,
+                     'dataset': 'train'}
+
+fcn_scale = 'fcn32s'
+params = {'num_classes': 20, 'rate': 1e-6, 'max_instance': 30,
+          'gt_class':{11:'person', 13:'car'},
+          'pred_class':{13:'car'},
+          'image_size': (1024, 2048),
+          'num_threads': 4,
+          'tsboard_save_path': '../data/tsboard_result/queue_%s'%model_type,
+          # fcn8s weights for 'instance', see train_fcn8_instance.py
+          'trained_weight_path':'../data/val_weights/fcn32s/city_fcn32s_skip_130000.npy',
+          'save_trained_weight_path':'../data/val_weights/'}
+
+train_dataset = dt.CityDataSet(train_data_config)
+train_iter = 50000
+val_step = 10000
+
+print('Training config: %s, iters %d'%(model_type, train_iter))
+with tf.Session() as sess:
+    (train_img, train_truth) = input_queue(train_dataset, image_size=params['image_size'], batch_size=1,
+                                           num_threads=params['num_threads'])
+    if model_type == 'instance':
+        model = InstanceFCN8s(data_path=params['trained_weight_path'], gt_class=params['gt_class'],
+                              pred_class=params['pred_class'], defer_init=True)
+        [train_op, loss] = model.train(params=params, image=train_img, gt_masks=train_truth, direct_slice=False,
+                                       save_var=True)
+        fname = 'city_instance_queue_%d.npy'
+    else:
+        model = FCN16VGG(params['trained_weight_path'], defer_init=True)
+        [train_op, loss] = model.train(params=params, image=train_img, truth=tf.reshape(train_truth, [-1]),
+                                       scale_min=fcn_scale, save_var=True)
+        fname = 'city_%s_queue_%%d.npy' % fcn_scale
+    tf.scalar_summary('train_loss', loss)
+    merged_summary = tf.merge_all_summaries()
+    writer = tf.train.SummaryWriter(params['tsboard_save_path'], sess.graph)
+
+    sess.run(tf.initialize_all_variables())
+    model.init_weights(sess)
+    model.release_weights()
+
+    coord = tf.train.Coordinator()
+    threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+    print('Start training...')
+    try:
+        for i in range(train_iter+1):
+            if coord.should_stop():
+                break
+            if i % 100 == 0:
+                # Loss and summary of the same batch the step trains on
+                _, summary, loss_value = sess.run([train_op, merged_summary, loss])
+                writer.add_summary(summary, i)
+                print('Iter %d Training Loss: %f' % (i, loss_value))
+            else:
+                sess.run(train_op)
+
+            if i >= val_step and i % val_step == 0:
+                fpath = params['save_trained_weight_path'] + fname % i
+                np.save(fpath, sess.run(model.var_dict))
+                print("trained weights saved: ", fpath)
+    except tf.errors.OutOfRangeError:
+        print('Input queue exhausted')
+    finally:
+        coord.request_stop()
+    coord.join(threads)
+    print('Finished training')
@@ -0,0 +1,91 @@
+'''
+Distillation training of the narrow StudentFCN8s from a frozen FCN16VGG fcn8s teacher.
+The teacher's stride 8 scores of every training image are cached to disk as float16
+the first time the image is drawn, so the teacher forward pass is paid once per image.
+The trained student weights are saved like the other training scripts and are loaded
+with StudentFCN8s(data_path=...).
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+sys.path.append("..")
+
+import os
+import random
+import numpy as np
+import tensorflow as tf
+
+from network.fcn_vgg16 import FCN16VGG
+from network.fcn_student import StudentFCN8s, STUDENT_WIDTHS
+import data_utils as dt
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+train_data_config = {'city_dir':"../data/CityDatabase",
+                     'randomize': False,
+                     'seed': None,
+                     'dataset': 'train'}
+
+params = {'num_classes': 20, 'rate': 1e-4,
+          'widths': STUDENT_WIDTHS,
+          'temperature': 2.0, 'alpha': 0.5,
+          'tsboard_save_path': '../data/tsboard_result/student',
+          'teacher_weight_path':'../data/val_weights/city_fcn8s_skip_100000.npy',
+          'student_weight_path': None,     # continue from a saved student
+          'teacher_cache_path':'../data/teacher_cache/fcn8s',   # None to run the teacher every step
+          'save_trained_weight_path':'../data/val_weights/'}
+
+train_dataset = dt.CityDataSet(train_data_config)
+train_iter = 100000
+val_step = 10000
+cache = dt.LogitCache(params['teacher_cache_path']) if params['teacher_cache_path'] is not None else None
+
+with tf.Session() as sess:
+    train_img = tf.placeholder(tf.float32, shape=[1, None, None, 3])
+    train_label = tf.placeholder(tf.int32, shape=[None])
+    teacher_scores = tf.placeholder(tf.float32, shape=[1, None, None, params['num_classes']])
+
+    with tf.variable_scope('teacher'):
+        teacher = FCN16VGG(params['teacher_weight_path'], defer_init=True)
+        teacher_scores_ = teacher.inference_lowres(train_img, params['num_classes'], scale='fcn8s')
+    with tf.variable_scope('student'):
+        student = StudentFCN8s(params['student_weight_path'], widths=params['widths'], defer_init=True)
+        [train_op, loss] = student.train_distill(params, train_img, train_label, teacher_scores,
+                                                 temperature=params['temperature'], alpha=params['alpha'])
+    tf.scalar_summary('train_loss', loss)
+    merged_summary = tf.merge_all_summaries()
+    writer = tf.train.SummaryWriter(params['tsboard_save_path'], sess.graph)
+
+    sess.run(tf.initialize_all_variables())
+    teacher.init_weights(sess)
+    teacher.release_weights()
+    student.init_weights(sess)
+    student.release_weights()
+
+    print('Start training...')
+    for i in range(train_iter+1):
+        img_id = random.randint(0, len(train_dataset.img_indices)-1)
+        (ids, images, labels) = next(train_dataset.batch_generator(1, [img_id]))
+
+        scores = cache.get(img_id) if cache is not None else None
+        if scores is None:
+            scores = sess.run(teacher_scores_, feed_dict={train_img: images})
+            if cache is not None:
+                cache.put(img_id, scores)
+
+        train_feed_dict = {train_img: images,
+                           train_label: np.reshape(labels, -1),
+                           teacher_scores: scores}
+        sess.run(train_op, train_feed_dict)
+        if i % 100 == 0:
+            summary, loss_value = sess.run([merged_summary, loss], train_feed_dict)
+            writer.add_summary(summary, i)
+            print('Iter %d Training Loss: %f' % (i, loss_value))
+
+        if i >= val_step and i % val_step == 0:
+            fpath = params['save_trained_weight_path'] + 'city_student_%d.npy' % i
+            np.save(fpath, sess.run(student.var_dict))
+            print("trained weights saved: ", fpath)
+    print('Finished training')